@@ -0,0 +1,254 @@
+"""Офлайн-бенчмарк бота: локальна копія сайту та фейковий Telegram Bot
+
+Використання:
+    python benchmarks/harness.py [--subscribers 100 10000 100000] [--rate 0]
+
+Сторінки генеруються синтетично і віддаються локальним aiohttp-сервером,
+тому мережа не потрібна. Звіт містить час розбору, пікову пам'ять
+(tracemalloc) і час завершення розсилки для різної кількості підписників.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+from aiohttp import web
+
+_tmp = tempfile.mkdtemp(prefix="bot-bench-")
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("DB_PATH", os.path.join(_tmp, "bench.db"))
+# Синтетичні сторінки не повинні потрапити в робочий знімок і архів бота
+os.environ.setdefault("SNAPSHOT_PATH", os.path.join(_tmp, "snapshot.json"))
+os.environ.setdefault("ARCHIVE_DIR", os.path.join(_tmp, "archive"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bot  # noqa: E402
+from synthetic import GROUPS, make_page  # noqa: E402
+from telegram.error import RetryAfter  # noqa: E402
+
+
+class FakeBot:
+    """Записує відправлені повідомлення; кожен retry_every-й виклик отримує RetryAfter"""
+
+    def __init__(self, latency=0.0, retry_every=0, retry_after=1):
+        self.latency = latency
+        self.retry_every = retry_every
+        self.retry_after = retry_after
+        self.calls = 0
+        self.sent = []
+        self.last_sent_at = None
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        if self.retry_every and self.calls % self.retry_every == 0:
+            raise RetryAfter(self.retry_after)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append((chat_id, len(text)))
+        self.last_sent_at = time.perf_counter()
+
+
+class FakeMessage:
+    def __init__(self, bot, chat_id):
+        self._bot = bot
+        self.chat_id = chat_id
+
+    async def reply_text(self, text, **kwargs):
+        kwargs.pop("reply_markup", None)
+        await self._bot.send_message(chat_id=self.chat_id, text=text, **kwargs)
+
+
+class FakeUpdate:
+    def __init__(self, bot, user_id):
+        self.effective_user = self.effective_chat = type("Peer", (), {"id": user_id})()
+        self.message = FakeMessage(bot, user_id)
+
+
+class FakeContext:
+    def __init__(self, bot, args=None):
+        self.bot = bot
+        self.args = args or []
+        self.user_data = {}
+
+
+def freeze_time(moment):
+    """Фіксує datetime.now() у модулі бота, щоб хвилина розсилки не змінилась під час заміру"""
+    class FrozenDateTime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return moment
+
+    bot.datetime = FrozenDateTime
+
+
+async def start_stub_server(pages):
+    """Локальна копія сайту: /page/<розмір> з ETag для умовних запитів"""
+    async def handler(request):
+        name = request.match_info["name"]
+        body = pages[name]
+        etag = f'"{name}-{len(body)}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+        return web.Response(text=body, content_type="text/html", headers={"ETag": etag})
+
+    app = web.Application()
+    app.router.add_get("/page/{name}", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/page/"
+
+
+async def measure(coro_factory, memory):
+    """Повертає (результат, секунди, піковий обсяг пам'яті в МБ або None)"""
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = await coro_factory()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20 if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def use_page(base_url, name):
+    state = bot.source_states[bot.DEFAULT_SOURCE]
+    state.page_cache = bot.PageCache(base_url + name, bot.PAGE_CACHE_TTL)
+    state.parsed["key"] = None
+
+
+def fill_subscribers(count, minute):
+    store = bot.SubscriberStore(os.path.join(_tmp, f"subscribers-{count}.db"))
+    notify_time = bot.notification_time(minute)
+    for user_id in range(1, count + 1):
+        store.set_group(user_id, GROUPS[user_id % len(GROUPS)])
+        store.set_time(user_id, notify_time)
+    store.flush()
+    bot.subscribers = store
+    # Окрема черга на кожен замір, інакше вже надіслані записи не повторяться
+    bot.outbox = bot.Outbox(os.path.join(_tmp, f"subscribers-{count}.db"))
+    return store
+
+
+def fmt_memory(peak):
+    return "-" if peak is None else f"{peak:8.1f} МБ"
+
+
+async def run(args):
+    moment = bot.TIMEZONE.localize(datetime(2026, 1, 15, 8, 0))
+    freeze_time(moment)
+    day = moment.date()
+    memory = not args.no_memory
+
+    pages = {
+        f"rows-{rows}": make_page(day, days=3, rows_per_day=rows)
+        for rows in args.page_rows
+    }
+    runner, base_url = await start_stub_server(pages)
+
+    rate = args.rate or 1e9
+    bot.delivery = bot.DeliveryEngine(bot.SEND_WORKERS, rate, args.chat_rate or 1e9)
+    state = bot.source_states[bot.DEFAULT_SOURCE]
+    state.parse_pool = bot.ParsePool(args.executor, bot.PARSE_WORKERS, bot.PARSE_TIMEOUT, bot.PARSE_MAX_JOBS)
+
+    try:
+        # Запуск пулу розбору не входить у заміри
+        await state.parse_pool.run(bot.build_replacements_index, make_page(day, days=1, rows_per_day=1), day)
+
+        print("\nРозбір сторінки (fetch + parse, холодний кеш)")
+        for name, html in pages.items():
+            use_page(base_url, name)
+            index, elapsed, peak = await measure(bot.get_replacements_index, memory)
+            groups = index.get(day.isoformat(), {}) if index else {}
+            rows = sum(len(items) for items in groups.values())
+            print(f"  {name:<12} {len(html) / 1024:8.0f} КБ  {elapsed * 1000:9.1f} мс  "
+                  f"{fmt_memory(peak)}  замін: {rows}")
+
+        use_page(base_url, f"rows-{args.page_rows[0]}")
+        index = await bot.get_replacements_index()
+
+        print("\nformat_message для всіх груп")
+
+        async def render_all():
+            for _ in range(args.render_rounds):
+                for group in GROUPS:
+                    bot.format_message(bot.lookup_replacements(index, group), group)
+
+        _, elapsed, peak = await measure(render_all, memory)
+        calls = args.render_rounds * len(GROUPS)
+        print(f"  {calls} викликів: {elapsed * 1000:.1f} мс ({elapsed / calls * 1e6:.1f} мкс/виклик)  "
+              f"{fmt_memory(peak)}")
+
+        print(f"\n/check: {args.checks} одночасних запитів")
+        fake = FakeBot(latency=args.latency)
+
+        async def run_checks():
+            await asyncio.gather(*(
+                bot.check(FakeUpdate(fake, user_id), FakeContext(fake))
+                for user_id in range(1, args.checks + 1)
+            ))
+
+        fill_subscribers(args.checks, bot.minute_of_day(moment.time()))
+        _, elapsed, peak = await measure(run_checks, memory)
+        print(f"  {elapsed * 1000:.1f} мс, надіслано {len(fake.sent)}  {fmt_memory(peak)}  "
+              f"кеш сторінки: {state.page_cache.stats()}")
+
+        print("\nЩоденна розсилка (send_daily_notification)")
+        for count in args.subscribers:
+            fill_subscribers(count, bot.minute_of_day(moment.time()))
+            fake = FakeBot(latency=args.latency, retry_every=args.retry_every)
+            started = time.perf_counter()
+            
+            async def broadcast():
+                # Тік лише ставить розсилку в чергу, відправка завершується у фоні
+                bot._last_broadcast = None
+                await bot.send_daily_notification(FakeContext(fake))
+                if bot.drain_task is not None:
+                    await bot.drain_task
+            
+            _, elapsed, peak = await measure(broadcast, memory)
+            last = (fake.last_sent_at - started) if fake.last_sent_at else 0.0
+            print(f"  {count:>7} підписників: {elapsed:8.2f} с (остання доставка {last:.2f} с)  "
+                  f"{fmt_memory(peak)}  надіслано {len(fake.sent)}, RetryAfter {fake.calls - len(fake.sent)}")
+            if args.rate:
+                continue
+            print(f"          за лімітом Telegram 30 повідомлень/с: ~{len(fake.sent) / 30:.0f} с")
+    finally:
+        await bot.delivery.stop()
+        await bot.close_http_session()
+        state.parse_pool.shutdown()
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, nargs="+", default=[100, 10000, 100000])
+    parser.add_argument("--page-rows", type=int, nargs="+", default=[40, 400, 4000])
+    parser.add_argument("--checks", type=int, default=200)
+    parser.add_argument("--render-rounds", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=0, help="глобальний ліміт, повідомлень/с (0 - без ліміту)")
+    parser.add_argument("--chat-rate", type=float, default=0, help="ліміт на чат, повідомлень/с (0 - без ліміту)")
+    parser.add_argument("--latency", type=float, default=0.0, help="затримка фейкового send_message, с")
+    parser.add_argument("--retry-every", type=int, default=10000, help="кожен N-й виклик отримує RetryAfter (0 - вимкнено)")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--no-memory", action="store_true", help="не вимірювати пам'ять (tracemalloc уповільнює заміри)")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Пам'ять на підписника: попереднє розміщення в словниках проти компактного SubscriberStore
+
+Використання:
+    python benchmarks/memory_bench.py [--users 1000 100000]
+
+Старий варіант - словник {"group": str, "time": datetime.time} на користувача
+плюс окремий user_data зі прапорцями діалогу; проміжний - словник
+user_id -> Subscriber (namedtuple). Новий - паралельні масиви SubscriberStore
+з інтернованими групами та бітовим станом.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import tracemalloc
+from datetime import time
+from pathlib import Path
+
+_tmp = tempfile.mkdtemp(prefix="bot-memory-")
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("DB_PATH", os.path.join(_tmp, "bench.db"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bot  # noqa: E402
+from synthetic import GROUPS  # noqa: E402
+
+
+def rows(count):
+    """Однакові дані для обох варіантів: (user_id, група, хвилина, чекає на введення часу)"""
+    for i in range(count):
+        user_id = 300_000_000 + i * 7919
+        yield user_id, GROUPS[i % len(GROUPS)], 360 + i % 240, i % 50 == 0
+
+
+def build_dicts(count):
+    user_data = {}
+    conversation = {}
+    for user_id, group, minute, waiting in rows(count):
+        user_data[user_id] = {"group": group, "time": time(minute // 60, minute % 60)}
+        conversation[user_id] = {"waiting_custom_time": waiting, "waiting_report": False}
+    return user_data, conversation
+
+
+def build_tuples(count):
+    records = {}
+    states = {}
+    for user_id, group, minute, waiting in rows(count):
+        records[user_id] = bot.Subscriber(group, minute)
+        if waiting:
+            states[user_id] = bot.STATE_WAITING_CUSTOM_TIME
+    return records, states
+
+
+def build_store(count):
+    store = bot.SubscriberStore(os.path.join(_tmp, f"memory-{count}.db"))
+    for user_id, group, minute, waiting in rows(count):
+        store._put(user_id, bot.Subscriber(group, minute))
+        if waiting:
+            store.set_state(user_id, bot.STATE_WAITING_CUSTOM_TIME)
+    # Відкладений запис у базу не входить у постійний обсяг пам'яті
+    store._pending.clear()
+    return store
+
+
+def measure(build, count):
+    tracemalloc.start()
+    result = build(count)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 100000])
+    args = parser.parse_args()
+    
+    logging.disable(logging.WARNING)
+    
+    for count in args.users:
+        print(f"\n{count} користувачів")
+        old = measure(build_dicts, count)
+        for name, build in (("словники", build_dicts), ("namedtuple", build_tuples), ("масиви", build_store)):
+            used = measure(build, count)
+            print(f"  {name:<11} {used / 2 ** 20:7.1f} МБ  {used / count:5.0f} Б/користувача  x{old / used:.1f}")
+
+
+if __name__ == '__main__':
+    main()
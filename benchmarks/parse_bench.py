@@ -0,0 +1,159 @@
+"""Порівняння бекендів парсера на збережених копіях сторінки
+
+Використання:
+    python benchmarks/parse_bench.py [файли.html або каталоги ...] [--date 2026-01-15]
+    python benchmarks/parse_bench.py --archive archive
+    python benchmarks/parse_bench.py --fuzz 3000
+
+Без аргументів використовуються сторінки з benchmarks/pages/, а якщо їх
+немає - синтетичні сторінки різного розміру. З --archive корпусом є всі
+версії сторінки з архіву бота (ARCHIVE_DIR), кожна розбирається на дату
+своєї першої появи.
+
+Еталоном є початковий parse_replacements (reference_parser.py): для кожної
+групи з таблиці на дату результат бекенду має збігатися з ним (назва групи
+порівнюється в канонічному вигляді). Збіг доведено лише на тих сторінках,
+на яких скрипт запускали; з --fuzz сторінки псуються випадково (обірвані та
+зайві теги). bs4 і stream на такій розмітці збігаються з початковим
+парсером, а lxml і selectolax лагодять теги по-своєму і можуть розходитися.
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("ADMIN_ID", "1")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bot  # noqa: E402
+from reference_parser import original_results  # noqa: E402
+from synthetic import make_page  # noqa: E402
+
+PAGES_DIR = Path(__file__).resolve().parent / "pages"
+
+
+def load_pages(paths, day):
+    pages = []
+    for path in paths:
+        path = Path(path)
+        files = sorted(path.glob("*.html")) if path.is_dir() else [path]
+        for file in files:
+            pages.append((file.name, file.read_text(encoding="utf-8", errors="replace"), day))
+    
+    if not pages:
+        for rows in (40, 400, 4000):
+            pages.append((f"synthetic-{rows}", make_page(day, days=3, rows_per_day=rows), day))
+    
+    return pages
+
+
+def load_archive(path):
+    archive = bot.PageArchive(path)
+    try:
+        return [
+            (f"{digest[:12]} {seen:%d.%m.%Y %H:%M}", html, seen.date())
+            for digest, seen, html in archive.iter_pages()
+        ]
+    finally:
+        archive.close()
+
+
+def normalized(replacements):
+    """Індекс зберігає канонічну назву групи (КН-107), початковий парсер - як на сторінці"""
+    if not replacements:
+        return replacements
+    return [dict(repl, group=bot.canonical_group(repl['group'])) for repl in replacements]
+
+
+def compare(expected, day, index):
+    """Групи, для яких індекс бекенду розходиться з початковим парсером"""
+    return [
+        group for group, replacements in expected.items()
+        if normalized(bot.lookup_replacements(index, group, day)) != normalized(replacements)
+    ]
+
+
+def corrupt(html, rng):
+    """Випадково псує розмітку: прибирає, дублює або обриває теги"""
+    tags = ["</td>", "</tr>", "<tr>", "</table>", "<td>", "</th>"]
+    for _ in range(rng.randint(1, 5)):
+        tag = rng.choice(tags)
+        positions = [i for i in range(len(html)) if html.startswith(tag, i)]
+        if not positions:
+            continue
+        pos = rng.choice(positions)
+        action = rng.randrange(3)
+        if action == 0:
+            html = html[:pos] + html[pos + len(tag):]
+        elif action == 1:
+            html = html[:pos] + tag + html[pos:]
+        else:
+            html = html[:pos + rng.randint(1, len(tag) - 1)] + html[pos + len(tag):]
+    return html
+
+
+def fuzz(count, day, seed=0):
+    rng = random.Random(seed)
+    mismatches = {backend: 0 for backend in bot.PARSER_BACKENDS}
+    
+    for i in range(count):
+        html = corrupt(make_page(day, days=2, rows_per_day=8, seed=i), rng)
+        expected = original_results(html, day)
+        for backend in bot.PARSER_BACKENDS:
+            if compare(expected, day, bot.build_replacements_index(html, day, backend)):
+                mismatches[backend] += 1
+    
+    print(f"Зіпсовані сторінки: {count}")
+    for backend, failed in mismatches.items():
+        print(f"  {backend:<11} розходжень з початковим парсером: {failed}")
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", default=[PAGES_DIR] if PAGES_DIR.exists() else [])
+    parser.add_argument("--date", type=date.fromisoformat, default=date.today())
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--archive", help="каталог архіву сторінок бота")
+    parser.add_argument("--fuzz", type=int, metavar="N", help="перевірити N випадково зіпсованих сторінок")
+    args = parser.parse_args()
+    
+    logging.disable(logging.CRITICAL)
+    
+    if args.fuzz:
+        fuzz(args.fuzz, args.date)
+        return
+    
+    pages = load_archive(args.archive) if args.archive else load_pages(args.paths, args.date)
+    if not pages:
+        print("Немає сторінок для порівняння")
+    
+    for name, html, day in pages:
+        expected = original_results(html, day)
+        base = measure(lambda: bot.build_replacements_index(html, day, "bs4"), args.repeat)
+        print(f"\n{name}: {len(html) / 1024:.0f} КБ")
+        
+        for backend in bot.PARSER_BACKENDS:
+            result = bot.build_replacements_index(html, day, backend)
+            elapsed = measure(lambda: bot.build_replacements_index(html, day, backend), args.repeat)
+            differs = compare(expected, day, result)
+            status = f"ВІДРІЗНЯЄТЬСЯ: {', '.join(differs[:5])}" if differs else "ok"
+            print(f"  {backend:<11} {elapsed * 1000:9.1f} мс  x{base / elapsed:5.1f}  {status}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Початковий parse_replacements без завантаження і журналу - еталон для порівняння бекендів
+
+Логіка перенесена з першої версії bot.py без змін: повне дерево
+BeautifulSoup, таблиця після першої згадки дати (або перша таблиця),
+точний збіг назви групи з першою клітинкою рядка.
+"""
+from bs4 import BeautifulSoup
+
+MONTHS_UK = {
+    1: "січня", 2: "лютого", 3: "березня", 4: "квітня",
+    5: "травня", 6: "червня", 7: "липня", 8: "серпня",
+    9: "вересня", 10: "жовтня", 11: "листопада", 12: "грудня"
+}
+
+
+def _target_table(soup, day):
+    day_uk = f"{day.day} {MONTHS_UK[day.month]} {day.year}"
+    date_element = soup.find(string=lambda text: text and day_uk in text)
+
+    if not date_element:
+        all_tables = soup.find_all('table')
+        return all_tables[0] if all_tables else None
+
+    return date_element.find_next('table')
+
+
+def _rows(table):
+    for row in table.find_all('tr'):
+        cells = row.find_all(['td', 'th'])
+        if len(cells) >= 4:
+            yield cells
+
+
+def _groups(table):
+    groups = []
+    for cells in _rows(table):
+        group_text = cells[0].get_text(strip=True)
+        if not group_text or "Групи" in group_text or group_text == "№":
+            continue
+        if group_text not in groups:
+            groups.append(group_text)
+    return groups
+
+
+def _replacements(table, target_group):
+    replacements = []
+    for cells in _rows(table):
+        group_text = cells[0].get_text(strip=True)
+        pair_num = cells[1].get_text(strip=True)
+
+        if not group_text or "Групи" in group_text or group_text == "№":
+            continue
+
+        if target_group == group_text:
+            old_subject = cells[2].get_text(strip=True)
+            new_subject = cells[3].get_text(strip=True)
+
+            if pair_num and pair_num not in ["№", "пар"]:
+                if "———" in old_subject:
+                    old_subject = "—"
+
+                replacements.append({
+                    'group': group_text,
+                    'pair': pair_num,
+                    'old': old_subject if old_subject else "—",
+                    'new': new_subject if new_subject else "—"
+                })
+
+    return replacements if replacements else None
+
+
+def original_replacements(html, day, target_group):
+    """Заміни групи на дату: список словників або None, як у початковому parse_replacements"""
+    table = _target_table(BeautifulSoup(html, 'html.parser'), day)
+    return _replacements(table, target_group) if table is not None else None
+
+
+def original_results(html, day):
+    """Результат початкового парсера для кожної групи з таблиці на дату, за один розбір сторінки"""
+    table = _target_table(BeautifulSoup(html, 'html.parser'), day)
+    if table is None:
+        return {}
+    return {group: _replacements(table, group) for group in _groups(table)}
@@ -0,0 +1,47 @@
+"""Генератор синтетичних сторінок замін у розмітці, схожій на mbk.mk.ua"""
+import random
+from datetime import timedelta
+
+MONTHS_UK = {
+    1: "січня", 2: "лютого", 3: "березня", 4: "квітня",
+    5: "травня", 6: "червня", 7: "липня", 8: "серпня",
+    9: "вересня", 10: "жовтня", 11: "листопада", 12: "грудня"
+}
+
+GROUPS = ["Б-101", "Д-103", "Д-104", "БМ-106", "КН-107"]
+
+
+def make_page(start_day, days=2, rows_per_day=40, groups=None, seed=0):
+    """Сторінка WordPress з кількома датами, кожна зі своєю таблицею замін"""
+    rnd = random.Random(seed)
+    groups = groups or GROUPS
+    parts = [
+        "<!DOCTYPE html><html><head><title>Заміни</title>",
+        "<script>var wp = {'page': 17254};</script></head><body>",
+        "<div id=\"content\"><article class=\"page\"><div class=\"entry-content\">",
+    ]
+    
+    for offset in range(days):
+        day = start_day + timedelta(days=offset)
+        parts.append(
+            f"<p style=\"text-align: center;\"><strong>Заміни на {day.day} "
+            f"{MONTHS_UK[day.month]} {day.year} року</strong></p>"
+        )
+        parts.append(
+            "<table border=\"1\"><tbody><tr><td><strong>Групи</strong></td>"
+            "<td><strong>№ пар</strong></td><td><strong>Було</strong></td>"
+            "<td><strong>Буде</strong></td></tr>"
+        )
+        for idx in range(rows_per_day):
+            group = rnd.choice(groups)
+            pair = rnd.randint(1, 6)
+            old = "———" if idx % 7 == 0 else f"Предмет {rnd.randint(1, 40)} (викл. Іваненко І.І.)"
+            new = f"Предмет {rnd.randint(1, 40)} <br>ауд. {rnd.randint(100, 420)}"
+            parts.append(
+                f"<tr><td><p>{group}</p></td><td>{pair}</td>"
+                f"<td>{old}</td><td>{new}</td></tr>"
+            )
+        parts.append("</tbody></table><p>&nbsp;</p>")
+    
+    parts.append("</div></article></div><footer>© МБК</footer></body></html>")
+    return "".join(parts)
@@ -1,175 +1,2180 @@
 import asyncio
+import bisect
+import cProfile
+import gzip
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
-from datetime import datetime, time
+import random
+import re
+import secrets
+import signal
+import socket
+import sqlite3
+import tracemalloc
+from array import array
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache, wraps
+from html.parser import HTMLParser
+from itertools import chain, count, groupby
+from operator import itemgetter
+from time import monotonic, perf_counter, thread_time, time as unix_time
 import pytz
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, NavigableString
 import aiohttp
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from aiohttp import web
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters, ConversationHandler
 
+# Необов'язкові швидкі парсери
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:
+    lxml = None
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# Необов'язкове стиснення архіву zstd (інакше gzip)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Налаштування логування
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger(f"{__name__}.trace")
 
 # Конфігурація 
 TOKEN = os.getenv("BOT_TOKEN") 
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))  
 PARSE_URL = "http://mbk.mk.ua/?page_id=17254"
+SOURCES_FILE = os.getenv("SOURCES_FILE", "")  # JSON-список джерел, порожній - лише сайт МБК
+SOURCE_WAIT = float(os.getenv("SOURCE_WAIT", "10"))  # секунд очікування джерела, далі віддається знімок
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "300"))  # секунд
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))  # секунд
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", "4"))
+HTTP_USER_AGENT = os.getenv("HTTP_USER_AGENT", "MBKReplacementsBot/1.0 (aiohttp)")
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "2"))  # повторних спроб завантаження
+FETCH_BACKOFF = float(os.getenv("FETCH_BACKOFF", "1"))  # секунд, подвоюється з кожною спробою
+FETCH_BACKOFF_MAX = float(os.getenv("FETCH_BACKOFF_MAX", "10"))  # секунд
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "3"))  # невдалих завантажень поспіль до паузи
+CIRCUIT_RESET = float(os.getenv("CIRCUIT_RESET", "60"))  # секунд паузи перед пробним запитом
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshot.json")  # останній вдалий індекс
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")  # архів версій сторінки, порожній - вимкнено
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "stream")  # stream, bs4, lxml, selectolax
+PARSE_EXECUTOR = os.getenv("PARSE_EXECUTOR", "process")  # process або thread
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", "2"))
+PARSE_TIMEOUT = float(os.getenv("PARSE_TIMEOUT", "20"))  # секунд
+PARSE_MAX_JOBS = int(os.getenv("PARSE_MAX_JOBS", "2"))
 DEFAULT_NOTIFICATION_TIME = time(8, 0, 0)
+DB_PATH = os.getenv("DB_PATH", "bot.db")
+DB_FLUSH_INTERVAL = int(os.getenv("DB_FLUSH_INTERVAL", "5"))  # секунд
+WORKERS = int(os.getenv("WORKERS", "1"))  # процесів розсилки
+WORKER_INDEX = 0  # номер поточного воркера, 0 - головний процес
+LEASE_TTL = int(os.getenv("LEASE_TTL", "60"))  # секунд оренди ролі завантажувача
+# Опублікований індекс старший за це вважається застарілим: TTL кешу лідера, хвилина його циклу і оренда
+PUBLISHED_MAX_AGE = PAGE_CACHE_TTL + 60 + LEASE_TTL
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "256"))
+EVENING_NOTIFICATION_HOUR = int(os.getenv("EVENING_NOTIFICATION_HOUR", "15"))  # з цієї години - заміни на завтра
+POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "300"))  # секунд, 0 - вимкнено
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+GLOBAL_RATE_LIMIT = float(os.getenv("GLOBAL_RATE_LIMIT", "30"))  # повідомлень за секунду
+CHAT_RATE_LIMIT = float(os.getenv("CHAT_RATE_LIMIT", "1"))  # повідомлень за секунду в один чат
+CHAT_BURST = 3
+CHECK_COOLDOWN = float(os.getenv("CHECK_COOLDOWN", "15"))  # секунд між /check одного користувача
+CHECK_MAX_PENDING = int(os.getenv("CHECK_MAX_PENDING", "300"))  # одночасних /check, решта відхиляються
+SEND_MAX_RETRIES = 3
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "500"))  # частин за один прохід черги
+OUTBOX_DRAIN_INTERVAL = int(os.getenv("OUTBOX_DRAIN_INTERVAL", "15"))  # секунд між перевірками повторів
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_BACKOFF = float(os.getenv("OUTBOX_BACKOFF", "30"))  # секунд до першого повтору, далі вдвічі більше
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "3600"))  # секунд
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
 TIMEZONE = pytz.timezone('Europe/Kiev')
 
+# Режим роботи: polling (за замовчуванням) або webhook
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публічна адреса, напр. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Метрики Prometheus на локальному порту (0 - вимкнено)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9110"))  # воркер N слухає METRICS_PORT + N
+
+# Профілювання обробників: частка викликів під cProfile (0 - лише вимір часу)
+PROFILE_SAMPLE = float(os.getenv("PROFILE_SAMPLE", "0"))
+PROFILE_THRESHOLD = float(os.getenv("PROFILE_THRESHOLD", "1"))  # секунд, повільніші виклики зберігаються
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "") == "1"  # знімок tracemalloc разом з профілем
+PROFILE_TRACE_FRAMES = 10
+
+# Бот обробляє лише повідомлення та натискання кнопок
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
 # Перевірка налаштувань
 if not TOKEN:
     raise ValueError("❌ BOT_TOKEN не встановлено в змінних оточення!")
 if ADMIN_ID == 0:
     raise ValueError("❌ ADMIN_ID не встановлено в змінних оточення!")
+if RUN_MODE == "webhook" and not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", WEBHOOK_SECRET):
+    # Без секрету будь-хто з доступом до порту може надіслати оновлення від імені адміністратора
+    raise ValueError("❌ WEBHOOK_SECRET (1-256 символів A-Z, a-z, 0-9, _ і -) обов'язковий у режимі webhook!")
+
+# Доступні групи, поки реєстр ще не заповнено з сайту (перший курс навчального року GROUPS_BASE_YEAR)
+DEFAULT_GROUPS = ["Б-101", "Д-103", "Д-104", "БМ-106", "КН-107"]
+GROUPS_BASE_YEAR = 2025
+GROUPS_MAX_COURSE = int(os.getenv("GROUPS_MAX_COURSE", "4"))  # останній курс коледжу
+GROUPS = list(DEFAULT_GROUPS)
+
+# Латинські літери, схожі на кириличні (після upper())
+LOOKALIKE_LETTERS = str.maketrans("ABCEHIKMOPTXY", "АВСЕНІКМОРТХУ")
+GROUP_DASHES = str.maketrans({dash: "-" for dash in "‐‑‒–—―−"})
+GROUP_PREFIX_RE = re.compile(r"^(\D+?)[\s-]*(?=\d)")
+GROUP_NAME_RE = re.compile(r"^[А-ЯІЇЄҐ]{1,5}-\d{1,4}(?:[/.]\d{1,2})?$")
+
+
+@lru_cache(maxsize=4096)
+def canonical_group(name):
+    """Єдиний запис назви групи: «кн 107», «KH–107» і «КН-107» дають «КН-107»"""
+    name = name.strip().upper().translate(LOOKALIKE_LETTERS).translate(GROUP_DASHES)
+    name = GROUP_PREFIX_RE.sub(lambda match: match.group(1).rstrip(" -") + "-", name)
+    return " ".join(name.split())
+
+
+def academic_year(day):
+    """Рік початку навчального року (з 1 вересня)"""
+    return day.year if day.month >= 9 else day.year - 1
+
+
+# Джерело замін: сайт закладу або сторінка відділення зі своїми групами й розкладом перевірок
+Source = namedtuple("Source", ["id", "name", "url", "groups", "parser", "poll_interval", "concurrency"])
+SOURCE_ID_RE = re.compile(r"^[a-z0-9_-]{1,16}$")
+
+
+def load_sources(path):
+    """Джерела з JSON-файлу; перше з них - основне. Без файлу - лише сайт МБК"""
+    default = Source("mbk", "МБК", PARSE_URL, (), None, POLL_INTERVAL, 1)
+    if not path:
+        return {default.id: default}
+    
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    
+    sources = {}
+    for item in items:
+        source = default._replace(**{field: item[field] for field in Source._fields if field in item})
+        if not SOURCE_ID_RE.match(source.id) or source.id in sources:
+            raise ValueError(f"❌ Некоректний або повторний id джерела: {source.id!r}")
+        sources[source.id] = source._replace(groups=tuple(canonical_group(group) for group in source.groups))
+    
+    if not sources:
+        raise ValueError(f"❌ У {path} немає жодного джерела")
+    return sources
+
+
+SOURCES = load_sources(SOURCES_FILE)
+DEFAULT_SOURCE = next(iter(SOURCES))
+
+
+def qualify_group(source_id, group):
+    """Ключ підписки (джерело, група) одним рядком; групи основного джерела - без префікса"""
+    if not group or source_id == DEFAULT_SOURCE:
+        return group
+    return f"{source_id}:{group}"
+
+
+def split_group(key):
+    """(джерело, група) з ключа підписки"""
+    source_id, sep, group = key.partition(":")
+    if sep and source_id in SOURCES:
+        return source_id, group
+    return DEFAULT_SOURCE, key
+
+
+def canonical_subscription(text):
+    """«kpi:кн 107» -> «kpi:КН-107»; без префікса - група основного джерела"""
+    source_id, group = split_group(text.strip())
+    return qualify_group(source_id, canonical_group(group))
+
+
+def display_group(key):
+    """Назва групи для користувача; з кількома джерелами - разом з назвою джерела"""
+    if not key:
+        return key
+    source_id, group = split_group(key)
+    if len(SOURCES) == 1:
+        return group
+    return f"{group} ({SOURCES[source_id].name})"
+
+
+def source_filter(source_id):
+    """SQL-умова на колонку grp для підписок одного джерела (None - всі джерела)"""
+    if source_id is None:
+        return "", ()
+    if source_id == DEFAULT_SOURCE:
+        return " AND instr(grp, ':') = 0", ()
+    # ';' йде одразу після ':', тож діапазон охоплює рівно префікс і використовує індекс
+    return " AND grp >= ? AND grp < ?", (f"{source_id}:", f"{source_id};")
+
+# Метрики у текстовому форматі Prometheus
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    """Значення без втрати точності: {:g} лишає 6 значущих цифр, і лічильники понад 10^6 «стрибають»"""
+    if isinstance(value, int):
+        return str(int(value))
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """Лічильник або показник з мітками; collect() дозволяє читати значення під час запиту"""
+    
+    def __init__(self, name, help_text, kind, labels=(), collect=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labels = tuple(labels)
+        self.collect = collect
+        self._values = {}
+    
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+    
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+    
+    def values(self):
+        if self.collect is not None:
+            return dict(self.collect())
+        return dict(self._values)
+    
+    def total(self):
+        return sum(self.values().values())
+    
+    def render(self):
+        for key, value in sorted(self.values().items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """Гістограма з фіксованими межами кошиків"""
+    
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, "histogram", labels)
+        self.buckets = tuple(buckets)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+    
+    def summary(self, **labels):
+        """(кількість, середнє, верхня межа кошика для p95) по всіх мітках або для заданих"""
+        counts = [0] * len(self.buckets)
+        total = count = 0
+        series = [self._values.get(self._key(labels), [counts, 0.0, 0])] if labels else self._values.values()
+        for bucket_counts, series_sum, series_count in series:
+            counts = [a + b for a, b in zip(counts, bucket_counts)]
+            total += series_sum
+            count += series_count
+        
+        if not count:
+            return 0, 0.0, None
+        
+        seen = 0
+        p95 = None
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= count * 0.95:
+                p95 = bound
+                break
+        return count, total / count, p95
+    
+    def render(self):
+        for key, (bucket_counts, series_sum, series_count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, [('le', f'{bound:g}')])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {series_count}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series_sum)}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {series_count}"
+
+
+class MetricsRegistry:
+    """Реєстр метрик процесу"""
+    
+    def __init__(self):
+        self._metrics = []
+    
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+    
+    def counter(self, name, help_text, labels=(), collect=None):
+        return self._add(Metric(name, help_text, "counter", labels, collect))
+    
+    def gauge(self, name, help_text, labels=(), collect=None):
+        return self._add(Metric(name, help_text, "gauge", labels, collect))
+    
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+    
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.render())
+            except Exception as e:
+                logger.warning(f"⚠️ Не вдалося зібрати метрику {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+FETCH_SECONDS = metrics.histogram("bot_fetch_seconds", "Час завантаження сторінки замін", ["source", "status"])
+PARSE_SECONDS = metrics.histogram("bot_parse_seconds", "Час розбору сторінки", ["executor"])
+RENDER_SECONDS = metrics.histogram(
+    "bot_render_seconds", "Час рендерингу повідомлення (промахи кешу)",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+)
+SEND_SECONDS = metrics.histogram("bot_send_seconds", "Час виклику send_message для одного повідомлення")
+BROADCAST_SECONDS = metrics.histogram("bot_broadcast_seconds", "Тривалість відправки черги розсилки")
+BROADCAST_LAG_SECONDS = metrics.histogram(
+    "bot_broadcast_lag_seconds", "Від початку хвилини розсилки до останнього доставленого повідомлення"
+)
+BROADCAST_LAST_LAG = metrics.gauge("bot_broadcast_last_lag_seconds", "Лаг останньої розсилки")
+ERRORS = metrics.counter("bot_errors_total", "Помилки за місцем виникнення", ["where"])
+RETRY_AFTER = metrics.counter("bot_retry_after_total", "Відповіді RetryAfter від Telegram")
+CHECK_REQUESTS = metrics.counter("bot_check_requests_total", "Запити /check за результатом допуску", ["result"])
+metrics.gauge(
+    "bot_delivery_queue", "Повідомлення в черзі відправки за пріоритетом", ["priority"],
+    collect=lambda: {(str(priority),): value for priority, value in delivery.pending.items()}
+)
+metrics.gauge(
+    "bot_check_pending", "Запити /check в обробці",
+    collect=lambda: {(): check_scheduler.pending}
+)
+metrics.counter(
+    "bot_messages_sent_total", "Надіслані повідомлення",
+    collect=lambda: {(): delivery.sent}
+)
+metrics.counter(
+    "bot_page_cache_requests_total", "Звернення до кешу сторінки", ["source", "result"],
+    collect=lambda: {
+        (source_id, result): value
+        for source_id, state in source_states.items()
+        for result, value in state.page_cache.stats().items()
+    }
+)
+metrics.counter(
+    "bot_render_cache_requests_total", "Звернення до кешу повідомлень", ["result"],
+    collect=lambda: {("hits",): render_cache.hits, ("misses",): render_cache.misses}
+)
+metrics.gauge(
+    "bot_circuit_open", "Запити до сайту призупинено (1) після серії невдач", ["source"],
+    collect=lambda: {(source_id,): int(state.page_cache.breaker.is_open()) for source_id, state in source_states.items()}
+)
+metrics.gauge(
+    "bot_outbox", "Записи черги розсилки за статусом", ["status"],
+    collect=lambda: {(status,): count for status, count in outbox.counts().items()}
+)
+metrics.gauge(
+    "bot_subscribers", "Підписники за групою", ["group"],
+    collect=lambda: {(group,): count for group, count in subscribers.count_by_group().items()}
+)
+metrics.gauge(
+    "bot_subscribers_by_minute", "Підписники за часом сповіщення", ["time"],
+    collect=lambda: {
+        (notification_time(minute).strftime("%H:%M"),): count
+        for minute, count in subscribers.count_by_minute().items()
+    }
+)
+
+
+HANDLER_SECONDS = metrics.histogram("bot_handler_seconds", "Загальний час обробника або задачі", ["handler"])
+HANDLER_CPU_SECONDS = metrics.histogram(
+    "bot_handler_cpu_seconds", "Процесорний час потоку подій за час обробника або задачі", ["handler"]
+)
+
+
+class Profiler:
+    """Час обробників і задач (загальний і процесорний); вибірковий cProfile/tracemalloc для повільних викликів"""
+    
+    def __init__(self, sample, threshold, directory, memory=False):
+        self.sample = sample
+        self.threshold = threshold
+        self.directory = directory
+        self.memory = False
+        self.dumps = 0
+        self.slowest = {}
+        # cProfile працює на весь потік, тому одночасно профілюється лише один виклик
+        self._active = False
+        self.set_memory(memory)
+    
+    def set_memory(self, enabled):
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACE_FRAMES)
+        elif not enabled and self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = enabled
+    
+    def wrap(self, func):
+        """Обгортка для обробника або задачі; назва функції стає міткою в метриках"""
+        name = func.__name__
+        
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            profile = None
+            if self.sample > 0 and not self._active and random.random() < self.sample:
+                self._active = True
+                profile = cProfile.Profile()
+                profile.enable()
+            
+            started = perf_counter()
+            cpu_started = thread_time()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                # Процесорний час потоку циклу подій: під час await сюди потрапляють і інші задачі
+                wall = perf_counter() - started
+                cpu = thread_time() - cpu_started
+                if profile is not None:
+                    profile.disable()
+                    self._active = False
+                
+                HANDLER_SECONDS.observe(wall, handler=name)
+                HANDLER_CPU_SECONDS.observe(cpu, handler=name)
+                if wall > self.slowest.get(name, 0):
+                    self.slowest[name] = wall
+                if profile is not None and wall >= self.threshold:
+                    self._dump(name, wall, cpu, profile)
+        
+        return wrapper
+    
+    def _dump(self, name, wall, cpu, profile):
+        stamp = datetime.now(TIMEZONE).strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.directory, f"{name}-{stamp}-{wall * 1000:.0f}ms")
+        
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            profile.dump_stats(base + ".prof")
+            if self.memory and tracemalloc.is_tracing():
+                tracemalloc.take_snapshot().dump(base + ".tracemalloc")
+        except OSError as e:
+            logger.warning(f"⚠️ Не вдалося зберегти профіль {name}: {e}")
+            return
+        
+        self.dumps += 1
+        logger.warning(f"🐢 {name}: {wall:.2f} с (CPU {cpu:.2f} с), профіль збережено в {base}.prof")
+
+
+profiler = Profiler(PROFILE_SAMPLE, PROFILE_THRESHOLD, PROFILE_DIR, PROFILE_MEMORY)
 
-# Доступні групи
-GROUPS = ["Б-101", "Д-103", "Д-104", "БМ-106", "КН-107"]
 
 # Зберігання даних користувачів
-user_data = {}
+def minute_of_day(value):
+    """Хвилина доби (0..1439) для об'єкта time"""
+    return value.hour * 60 + value.minute
+
+
+def notification_time(minute):
+    """Об'єкт time для хвилини доби"""
+    return time(minute // 60, minute % 60)
+
+
+DEFAULT_NOTIFICATION_MINUTE = minute_of_day(DEFAULT_NOTIFICATION_TIME)
+
+Subscriber = namedtuple("Subscriber", ["group", "minute"])
+
+# Стан діалогу з користувачем: бітові прапорці
+STATE_WAITING_CUSTOM_TIME = 1
+STATE_WAITING_REPORT = 2
+
+
+class SubscriberStore:
+    """Сховище підписників у SQLite (WAL) з відкладеним записом змін
+    
+    У пам'яті підписники зберігаються паралельними масивами, впорядкованими за user_id:
+    id групи в реєстрі та хвилина сповіщень займають по 2 байти, пошук - бінарний.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._user_ids = array("q")
+        self._group_ids = array("H")
+        self._minute_of = array("H")
+        self._states = {}
+        self._pending = {}
+        self._minutes = Counter()
+        self.loaded = False
+    
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    user_id INTEGER PRIMARY KEY,
+                    grp TEXT,
+                    minute INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_subscribers_minute_group ON subscribers (minute, grp);
+                CREATE INDEX IF NOT EXISTS idx_subscribers_group ON subscribers (grp);
+            """)
+        return self._conn
+    
+    def load(self):
+        """Завантажує всіх підписників одним запитом при старті"""
+        # INTEGER PRIMARY KEY - це rowid, тож впорядкування за user_id нічого не коштує
+        cursor = self._connection().execute("SELECT user_id, grp, minute FROM subscribers ORDER BY user_id")
+        cursor.arraysize = 10000
+        
+        self._user_ids = array("q")
+        self._group_ids = array("H")
+        self._minute_of = array("H")
+        self._minutes = Counter()
+        
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for user_id, group, minute in rows:
+                self._user_ids.append(user_id)
+                self._group_ids.append(group_registry.intern(group))
+                self._minute_of.append(minute)
+                if group:
+                    self._minutes[minute] += 1
+        
+        self.loaded = True
+        logger.info(f"💾 Завантажено {len(self._user_ids)} підписників з {self.path}")
+    
+    def _find(self, user_id):
+        """Позиція user_id у масивах і чи він там уже є"""
+        i = bisect.bisect_left(self._user_ids, user_id)
+        return i, i < len(self._user_ids) and self._user_ids[i] == user_id
+    
+    def __contains__(self, user_id):
+        return self._find(user_id)[1]
+    
+    def __len__(self):
+        return len(self._user_ids)
+    
+    def get(self, user_id):
+        i, found = self._find(user_id)
+        if not found:
+            return None
+        return Subscriber(group_registry.name(self._group_ids[i]), self._minute_of[i])
+    
+    def set_group(self, user_id, group):
+        record = self.get(user_id)
+        minute = record.minute if record else DEFAULT_NOTIFICATION_MINUTE
+        return self._put(user_id, Subscriber(group, minute))
+    
+    def set_time(self, user_id, notify_time):
+        record = self.get(user_id)
+        group = record.group if record else None
+        return self._put(user_id, Subscriber(group, minute_of_day(notify_time)))
+    
+    def _put(self, user_id, record):
+        i, found = self._find(user_id)
+        group_id = group_registry.intern(record.group)
+        
+        if found:
+            if self._group_ids[i]:
+                old_minute = self._minute_of[i]
+                self._minutes[old_minute] -= 1
+                if not self._minutes[old_minute]:
+                    del self._minutes[old_minute]
+            self._group_ids[i] = group_id
+            self._minute_of[i] = record.minute
+        else:
+            # Нові користувачі рідкісні, зсув масивів - це memmove
+            self._user_ids.insert(i, user_id)
+            self._group_ids.insert(i, group_id)
+            self._minute_of.insert(i, record.minute)
+        
+        if record.group:
+            self._minutes[record.minute] += 1
+        
+        self._pending[user_id] = record
+        return record
+    
+    def has_state(self, user_id, flag):
+        return bool(self._states.get(user_id, 0) & flag)
+    
+    def set_state(self, user_id, flag, enabled=True):
+        """Прапорці діалогу; зберігаються лише для користувачів з ненульовим станом"""
+        state = self._states.get(user_id, 0)
+        state = state | flag if enabled else state & ~flag
+        if state:
+            self._states[user_id] = state
+        else:
+            self._states.pop(user_id, None)
+    
+    def flush(self):
+        """Записує накопичені зміни однією транзакцією"""
+        if not self._pending:
+            return 0
+        
+        pending, self._pending = self._pending, {}
+        conn = self._connection()
+        try:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO subscribers (user_id, grp, minute) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET grp = excluded.grp, minute = excluded.minute",
+                    [(user_id, record.group, record.minute) for user_id, record in pending.items()]
+                )
+        except Exception:
+            # Повертаємо незаписані зміни, новіші значення мають пріоритет
+            pending.update(self._pending)
+            self._pending = pending
+            raise
+        return len(pending)
+    
+    def has_due(self, minute, source=None):
+        if self.loaded and source is None:
+            return minute in self._minutes
+        
+        # Воркер розсилки без локальної копії: записи змінює інший процес
+        self.flush()
+        clause, params = source_filter(source)
+        row = self._connection().execute(
+            f"SELECT 1 FROM subscribers WHERE minute = ? AND grp IS NOT NULL{clause} LIMIT 1",
+            (minute, *params)
+        ).fetchone()
+        return row is not None
+    
+    def count_by_group(self):
+        """Кількість підписників у кожній групі"""
+        if self.loaded:
+            return Counter({
+                group_registry.name(group_id): count
+                for group_id, count in Counter(self._group_ids).items()
+                if group_id
+            })
+        self.flush()
+        rows = self._connection().execute(
+            "SELECT grp, COUNT(*) FROM subscribers WHERE grp IS NOT NULL GROUP BY grp"
+        )
+        return Counter(dict(rows))
+    
+    def count_by_minute(self):
+        """Кількість підписників на кожну хвилину сповіщення"""
+        if self.loaded:
+            return Counter(self._minutes)
+        self.flush()
+        rows = self._connection().execute(
+            "SELECT minute, COUNT(*) FROM subscribers WHERE grp IS NOT NULL GROUP BY minute"
+        )
+        return Counter(dict(rows))
+    
+    def iter_group(self, group, until_minute=1439, from_minute=0):
+        """Підписники групи, чий час сповіщень між from_minute і until_minute включно"""
+        self.flush()
+        cursor = self._connection().execute(
+            "SELECT user_id FROM subscribers WHERE grp = ? AND minute BETWEEN ? AND ?",
+            (group, from_minute, until_minute)
+        )
+        cursor.arraysize = 1000
+        
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for (user_id,) in rows:
+                yield user_id
+    
+    def iter_due(self, minute, shard=0, shards=1, source=None):
+        """Потік (група, user_id) для хвилини прямо з індексу, впорядкований за групою"""
+        self.flush()
+        clause, params = source_filter(source)
+        cursor = self._connection().execute(
+            "SELECT grp, user_id FROM subscribers "
+            f"WHERE minute = ? AND grp IS NOT NULL AND ((user_id % ?) + ?) % ? = ?{clause} ORDER BY grp",
+            (minute, shards, shards, shards, shard, *params)
+        )
+        cursor.arraysize = 1000
+        
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            yield from rows
+    
+    def close(self):
+        if self._conn is not None:
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+
+subscribers = SubscriberStore(DB_PATH)
+
+
+class SharedState:
+    """Спільний для воркерів стан у SQLite: оренда ролі завантажувача та опубліковані індекси джерел"""
+    
+    def __init__(self, path, holder):
+        self.path = path
+        self.holder = holder
+        self._conn = None
+        self._versions = {}
+        self._indexes = {}
+        self._leader = {}
+        self._renew_at = {}
+    
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                -- Індекс без джерела з попередніх версій: лише кеш, лідер опублікує його заново
+                DROP TABLE IF EXISTS published_index;
+                DROP TABLE IF EXISTS published_version;
+                CREATE TABLE IF NOT EXISTS published_indexes (
+                    source TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    grp TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (source, day, grp)
+                );
+                CREATE TABLE IF NOT EXISTS published_versions (
+                    source TEXT PRIMARY KEY,
+                    version REAL NOT NULL,
+                    day TEXT NOT NULL,
+                    checked_at REAL NOT NULL
+                );
+            """)
+        return self._conn
+    
+    def acquire_lease(self, name="fetcher", ttl=None):
+        """Захоплює або продовжує оренду; True, якщо роль належить цьому процесу"""
+        now = unix_time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                (name, self.holder, now + (ttl or LEASE_TTL), now)
+            )
+            row = conn.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == self.holder
+    
+    def is_fetcher(self, source=None):
+        """Чи цей процес зараз завантажує сторінку джерела (оренда продовжується заздалегідь)"""
+        source = source or DEFAULT_SOURCE
+        if monotonic() >= self._renew_at.get(source, 0.0):
+            # Оренди джерел незалежні, тож завантаження розподіляються між воркерами
+            name = "fetcher" if source == DEFAULT_SOURCE else f"fetcher:{source}"
+            self._leader[source] = self.acquire_lease(name)
+            self._renew_at[source] = monotonic() + LEASE_TTL / 3
+            if self._leader[source]:
+                logger.info(f"👑 Воркер {WORKER_INDEX} завантажує сторінку {source} для всіх")
+        return self._leader[source]
+    
+    def publish(self, index, day, source=None):
+        """Публікує розібраний на дату day індекс джерела (по рядку на дату і групу) для інших воркерів"""
+        source = source or DEFAULT_SOURCE
+        version = unix_time()
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM published_indexes WHERE source = ?", (source,))
+            conn.executemany(
+                "INSERT INTO published_indexes (source, day, grp, payload) VALUES (?, ?, ?, ?)",
+                [
+                    (source, day, group, json.dumps(items, ensure_ascii=False))
+                    for day, groups in index.items()
+                    for group, items in groups.items()
+                ]
+            )
+            conn.execute(
+                "INSERT INTO published_versions (source, version, day, checked_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (source) DO UPDATE SET version = excluded.version, day = excluded.day, "
+                "checked_at = excluded.checked_at",
+                (source, version, day.isoformat(), version)
+            )
+        self._versions[source], self._indexes[source] = version, index
+    
+    def confirm(self, source=None):
+        """Лідер перевірив сторінку, і опублікований індекс досі актуальний"""
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE published_versions SET checked_at = ? WHERE source = ?",
+                (unix_time(), source or DEFAULT_SOURCE)
+            )
+    
+    def load(self, day, max_age, source=None):
+        """Опублікований індекс джерела за day, перевірений лідером не давніше max_age (інакше None)"""
+        source = source or DEFAULT_SOURCE
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT version, day, checked_at FROM published_versions WHERE source = ?", (source,)
+        ).fetchone()
+        if row is None or row[1] != day.isoformat() or row[2] < unix_time() - max_age:
+            return None
+        
+        if row[0] != self._versions.get(source):
+            index = {}
+            rows = conn.execute("SELECT day, grp, payload FROM published_indexes WHERE source = ?", (source,))
+            for day, group, payload in rows:
+                index.setdefault(day, {})[group] = json.loads(payload)
+            self._versions[source], self._indexes[source] = row[0], index
+        
+        return self._indexes[source]
+
+
+shared_state = SharedState(DB_PATH, f"{socket.gethostname()}:{os.getpid()}")
+
+
+class Outbox:
+    """Стійка черга розсилки в SQLite: кожна частина (користувач, ключ, частина) зберігається один раз"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+    
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    user_id INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    part INTEGER NOT NULL,
+                    text TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt REAL NOT NULL,
+                    created REAL NOT NULL,
+                    error TEXT,
+                    PRIMARY KEY (user_id, key, part)
+                );
+                CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, next_attempt);
+            """)
+        return self._conn
+    
+    def enqueue(self, key, entries):
+        """Додає повідомлення (user_id, частини); вже наявні записи не дублюються"""
+        now = unix_time()
+        conn = self._connection()
+        before = conn.total_changes
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO outbox (user_id, key, part, text, next_attempt, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (user_id, key, part, text, now, now)
+                    for user_id, messages in entries
+                    for part, text in enumerate(messages)
+                )
+            )
+        return conn.total_changes - before
+    
+    def due_batch(self, limit, shard=0, shards=1):
+        """Частини, готові до відправки; наступна частина чекає, доки попередні не доставлено"""
+        return self._connection().execute(
+            "SELECT user_id, key, part, text, attempts FROM outbox "
+            "WHERE status = 'pending' AND next_attempt <= ? AND ((user_id % ?) + ?) % ? = ? "
+            "AND NOT EXISTS (SELECT 1 FROM outbox AS prev WHERE prev.user_id = outbox.user_id "
+            "AND prev.key = outbox.key AND prev.part < outbox.part AND prev.status != 'sent') "
+            "ORDER BY next_attempt LIMIT ?",
+            (unix_time(), shards, shards, shards, shard, limit)
+        ).fetchall()
+    
+    def mark_sent(self, user_id, key, part):
+        with self._connection() as conn:
+            conn.execute(
+                "UPDATE outbox SET status = 'sent', attempts = attempts + 1, error = NULL "
+                "WHERE user_id = ? AND key = ? AND part = ?",
+                (user_id, key, part)
+            )
+    
+    def mark_failed(self, user_id, key, part, attempts, error, permanent=False):
+        """Планує повтор з експоненційною затримкою або остаточно відмовляється від повідомлення"""
+        attempts += 1
+        with self._connection() as conn:
+            if permanent or attempts >= OUTBOX_MAX_ATTEMPTS:
+                # Решта частин без першої не має сенсу
+                conn.execute(
+                    "UPDATE outbox SET status = 'failed', attempts = ?, error = ? "
+                    "WHERE user_id = ? AND key = ? AND part >= ? AND status = 'pending'",
+                    (attempts, error, user_id, key, part)
+                )
+                return False
+            
+            delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF * 2 ** (attempts - 1))
+            conn.execute(
+                "UPDATE outbox SET attempts = ?, next_attempt = ?, error = ? "
+                "WHERE user_id = ? AND key = ? AND part = ?",
+                (attempts, unix_time() + random.uniform(delay / 2, delay), error, user_id, key, part)
+            )
+            return True
+    
+    def counts(self):
+        return Counter(dict(self._connection().execute(
+            "SELECT status, COUNT(*) FROM outbox GROUP BY status"
+        )))
+    
+    def backlog(self, status="pending", limit=10):
+        """Найстаріші записи зі статусом: (user_id, ключ, частина, спроби, наступна спроба, помилка)"""
+        return self._connection().execute(
+            "SELECT user_id, key, part, attempts, next_attempt, error FROM outbox "
+            "WHERE status = ? ORDER BY created, user_id, part LIMIT ?",
+            (status, limit)
+        ).fetchall()
+    
+    def oldest_pending(self):
+        row = self._connection().execute(
+            "SELECT MIN(created) FROM outbox WHERE status = 'pending'"
+        ).fetchone()
+        return row[0]
+    
+    def expire(self, today):
+        """Недоставлені записи за минулі дні вже не актуальні: друга частина ключа - дата"""
+        with self._connection() as conn:
+            return conn.execute(
+                "UPDATE outbox SET status = 'expired', error = 'застаріле' "
+                "WHERE status = 'pending' AND substr(key, instr(key, ':') + 1, 10) < ?",
+                (today.isoformat(),)
+            ).rowcount
+    
+    def retry_failed(self):
+        with self._connection() as conn:
+            return conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt = ? WHERE status = 'failed'",
+                (unix_time(),)
+            ).rowcount
+    
+    def prune(self, days):
+        """Видаляє доставлені та остаточно невдалі записи, старші за days"""
+        with self._connection() as conn:
+            return conn.execute(
+                "DELETE FROM outbox WHERE status != 'pending' AND created < ?",
+                (unix_time() - days * 86400,)
+            ).rowcount
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+outbox = Outbox(DB_PATH)
+
+
+class GroupRegistry:
+    """Групи з розібраних таблиць за навчальний рік; з них будується клавіатура вибору"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.year = None
+        self._conn = None
+        self._groups = set()
+        self._sorted = {}
+        self._last_index = {}
+        # Інтернування назв для компактних записів підписників: id 0 - група не обрана
+        self._names = [None]
+        self._ids = {}
+    
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=10)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS group_registry (
+                    year INTEGER NOT NULL,
+                    grp TEXT NOT NULL,
+                    PRIMARY KEY (year, grp)
+                )
+            """)
+        return self._conn
+    
+    def load(self, year):
+        rows = self._connection().execute("SELECT grp FROM group_registry WHERE year = ?", (year,))
+        self.year = year
+        self._groups = {group for group, in rows}
+        self._sort()
+        self._last_index = {}
+    
+    def _sort(self):
+        by_source = {}
+        for key in self._groups:
+            source_id, group = split_group(key)
+            by_source.setdefault(source_id, []).append(group)
+        self._sorted = {source_id: tuple(sorted(groups)) for source_id, groups in by_source.items()}
+    
+    def update(self, index, source=None):
+        """Додає нові групи джерела з індексу (кожен індекс переглядається один раз)"""
+        source = source or DEFAULT_SOURCE
+        if not index or index is self._last_index.get(source) or self.year is None:
+            return
+        self._last_index[source] = index
+        
+        new = {
+            qualify_group(source, group)
+            for groups in index.values()
+            for group in groups
+            if GROUP_NAME_RE.match(group)
+        } - self._groups
+        if not new:
+            return
+        
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO group_registry (year, grp) VALUES (?, ?)",
+                [(self.year, group) for group in new]
+            )
+        self._groups |= new
+        self._sort()
+        logger.info(f"📚 Нові групи в реєстрі: {', '.join(sorted(new))}")
+    
+    def intern(self, group):
+        """Сталий номер назви групи (на весь час роботи процесу)"""
+        if not group:
+            return 0
+        group_id = self._ids.get(group)
+        if group_id is None:
+            group_id = self._ids[group] = len(self._names)
+            self._names.append(group)
+        return group_id
+    
+    def name(self, group_id):
+        return self._names[group_id]
+    
+    def groups(self, source=None):
+        """Відсортовані групи джерела: список з налаштувань разом із знайденими в таблицях за рік"""
+        source = source or DEFAULT_SOURCE
+        configured = SOURCES[source].groups or (tuple(GROUPS) if source == DEFAULT_SOURCE else ())
+        found = self._sorted.get(source, ())
+        # Групи без жодної заміни цього року теж мають бути доступні для підписки
+        if not found:
+            return configured
+        return tuple(sorted(set(configured).union(found)))
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+group_registry = GroupRegistry(DB_PATH)
 
 # Стани для ConversationHandler
 WAITING_FOR_REPORT = 1
 WAITING_FOR_CUSTOM_TIME = 2
 
 
+_groups_year = None
+
+
 def update_groups_for_new_year():
-    """Оновлює номери груп після 1 вересня (перехід на новий курс)"""
-    global GROUPS
-    now = datetime.now(TIMEZONE)
+    """Раз на навчальний рік: перехід груп за замовчуванням на новий курс і новий реєстр груп"""
+    global GROUPS, _groups_year
+    year = academic_year(datetime.now(TIMEZONE).date())
+    
+    if year == _groups_year:
+        return
+    
+    # Рахується від початкового списку, тож повторний виклик нічого не змінює.
+    # Після випуску курс не росте: груп на кшталт Б-501 не існує, актуальні додає реєстр
+    course = min(1 + max(0, year - GROUPS_BASE_YEAR), GROUPS_MAX_COURSE)
+    GROUPS = [group.replace("-1", f"-{course}", 1) for group in DEFAULT_GROUPS]
+    group_registry.load(year)
     
-    if now.year >= 2026 and now.month >= 9:
-        GROUPS = [group.replace("-1", "-2") for group in GROUPS]
+    if _groups_year is not None:
         logger.info(f"Групи оновлено для нового навчального року: {GROUPS}")
+    _groups_year = year
 
 
-async def parse_replacements(target_group):
-    """Парсинг таблиці замін з сайту для конкретної групи"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(PARSE_URL, timeout=30) as response:
-                if response.status != 200:
-                    logger.error(f"Помилка запиту: статус {response.status}")
-                    return None
-                
-                html = await response.text()
+# Спільна HTTP-сесія: створюється в post_init, закривається при зупинці
+http_session = None
+
+
+def get_http_session():
+    """Довгоживуча сесія aiohttp з пулом keep-alive з'єднань"""
+    global http_session
+    
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            ttl_dns_cache=300,
+            keepalive_timeout=60
+        )
+        http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            headers={"User-Agent": HTTP_USER_AGENT}
+        )
+    
+    return http_session
+
+
+async def close_http_session():
+    global http_session
+    
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
+
+class CircuitOpenError(Exception):
+    """Запити до сайту тимчасово призупинено після серії невдач"""
+
+
+class CircuitBreaker:
+    """Після кількох невдач поспіль запити до сайту не виконуються протягом reset_timeout"""
+    
+    def __init__(self, failures, reset_timeout):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.consecutive = 0
+        self.opened_at = None
+    
+    def is_open(self):
+        return self.opened_at is not None
+    
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        
+        # Після паузи пропускаємо одну пробну спробу, решта знову чекає
+        if monotonic() - self.opened_at >= self.reset_timeout:
+            self.opened_at = monotonic()
+            return True
+        return False
+    
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("✅ Сайт знову доступний")
+        self.consecutive = 0
+        self.opened_at = None
+    
+    def record_failure(self):
+        self.consecutive += 1
+        if self.consecutive < self.failures:
+            return
+        
+        if self.opened_at is None:
+            logger.warning(
+                f"🔌 Сайт недоступний ({self.consecutive} невдач поспіль), "
+                f"запити призупинено на {self.reset_timeout:g} с"
+            )
+        self.opened_at = monotonic()
+
+
+class PageCache:
+    """Спільний кеш сторінки з умовними запитами (ETag / Last-Modified)"""
+    
+    def __init__(self, url, ttl, source=None):
+        self.url = url
+        self.ttl = ttl
+        self.source = source or DEFAULT_SOURCE
+        self.body = None
+        self.etag = None
+        self.last_modified = None
+        self.fetched_at = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.breaker = CircuitBreaker(CIRCUIT_FAILURES, CIRCUIT_RESET)
+        self._inflight = None
+    
+    def is_fresh(self):
+        return self.fetched_at is not None and monotonic() - self.fetched_at < self.ttl
+    
+    async def get(self, refresh=False):
+        """Повертає тіло сторінки; одночасні виклики чекають на один і той самий запит"""
+        if not refresh and self.is_fresh():
+            self.hits += 1
+            return self.body
+        
+        if self._inflight is None:
+            self.misses += 1
+            self._inflight = asyncio.ensure_future(self._fetch())
+            self._inflight.add_done_callback(self._clear_inflight)
+        else:
+            self.hits += 1
         
-        soup = BeautifulSoup(html, 'html.parser')
-        today = datetime.now(TIMEZONE)
+        return await asyncio.shield(self._inflight)
+    
+    def _clear_inflight(self, task):
+        self._inflight = None
     
-        months_uk = {
-            1: "січня", 2: "лютого", 3: "березня", 4: "квітня",
-            5: "травня", 6: "червня", 7: "липня", 8: "серпня",
-            9: "вересня", 10: "жовтня", 11: "листопада", 12: "грудня"
+    async def _fetch(self):
+        """Завантаження з повторними спробами; після серії невдач - швидка відмова"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Запити до {self.url} призупинено")
+        
+        for attempt in range(FETCH_RETRIES + 1):
+            started = perf_counter()
+            try:
+                body, status = await self._request()
+            except Exception as e:
+                FETCH_SECONDS.observe(perf_counter() - started, source=self.source, status="error")
+                ERRORS.inc(where="fetch")
+                logger.warning(f"🌐 Спроба {attempt + 1} завантаження {self.source} не вдалася: {e!r}")
+            else:
+                FETCH_SECONDS.observe(perf_counter() - started, source=self.source, status=status)
+                if body is not None:
+                    self.breaker.record_success()
+                    return body
+                # Помилки клієнта (крім 429) повтор не виправить
+                if status < 500 and status != 429:
+                    break
+            
+            if attempt < FETCH_RETRIES:
+                # Випадкова затримка до межі, щоб воркери не повторювали запити одночасно
+                delay = min(FETCH_BACKOFF_MAX, FETCH_BACKOFF * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, delay))
+        
+        self.breaker.record_failure()
+        return None
+    
+    async def _request(self):
+        headers = {}
+        if self.body is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        
+        async with get_http_session().get(self.url, headers=headers) as response:
+            if response.status == 304 and self.body is not None:
+                self.not_modified += 1
+                self.fetched_at = monotonic()
+                logger.info(f"📄 Сторінка {self.source} не змінилась (304)")
+                return self.body, response.status
+            
+            if response.status != 200:
+                logger.error(f"Помилка запиту {self.source}: статус {response.status}")
+                ERRORS.inc(where="fetch")
+                return None, response.status
+            
+            body = await response.text()
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+        
+        if body != self.body:
+            self.body = body
+            self.version += 1
+        self.fetched_at = monotonic()
+        return body, 200
+    
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
         }
+
+
+
+MONTHS_UK = {
+    1: "січня", 2: "лютого", 3: "березня", 4: "квітня",
+    5: "травня", 6: "червня", 7: "липня", 8: "серпня",
+    9: "вересня", 10: "жовтня", 11: "листопада", 12: "грудня"
+}
+
+# Бекенди парсера повертають потік подій у порядку документа:
+# str - текстовий вузол, list - таблиця (рядки зі списками текстів клітинок)
+
+
+def parse_events_bs4(html):
+    """Повне дерево BeautifulSoup (еталонна поведінка)"""
+    soup = BeautifulSoup(html, 'html.parser')
+    events = []
+    
+    for element in soup.descendants:
+        if isinstance(element, NavigableString):
+            events.append(str(element))
+        elif element.name == 'table':
+            events.append([
+                [cell.get_text(strip=True) for cell in row.find_all(['td', 'th'])]
+                for row in element.find_all('tr')
+            ])
+    
+    return events
+
+
+class TableStreamParser(HTMLParser):
+    """Потоковий токенайзер: без побудови дерева, збирає лише тексти та вміст таблиць"""
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.events = []
+        self._text = []
+        self._raw = 0
+        self._stack = []
+        self._tables = []
+        self._rows = []
+        self._cells = []
+    
+    def _flush_text(self):
+        if not self._text:
+            return
+        
+        text = "".join(self._text)
+        self._text = []
+        self.events.append(text)
         
-        # Формат: "15 січня 2026"
-        today_uk = f"{today.day} {months_uk[today.month]} {today.year}"
+        # Як get_text(strip=True): кожен вузол обрізається окремо, script/style не враховуються
+        stripped = text.strip()
+        if stripped and not self._raw:
+            for cell in self._cells:
+                cell.append(stripped)
+    
+    def handle_data(self, data):
+        self._text.append(data)
+    
+    def handle_comment(self, data):
+        self._flush_text()
+        self.events.append(data)
+    
+    def handle_decl(self, decl):
+        self._flush_text()
+    
+    def handle_pi(self, data):
+        self._flush_text()
+    
+    def handle_starttag(self, tag, attrs):
+        self._flush_text()
         
-        logger.info(f"🔍 Шукаємо дату: {today_uk}")
-        logger.info(f"🔍 Група: {target_group}")
+        if tag in ('script', 'style'):
+            self._raw += 1
+        elif tag == 'table':
+            rows = []
+            self.events.append(rows)
+            self._tables.append(rows)
+            self._stack.append(tag)
+        elif tag == 'tr' and self._tables:
+            row = []
+            for rows in self._tables:
+                rows.append(row)
+            self._rows.append(row)
+            self._stack.append(tag)
+        elif tag in ('td', 'th') and self._rows:
+            cell = []
+            for row in self._rows:
+                row.append(cell)
+            self._cells.append(cell)
+            self._stack.append(tag)
+    
+    def handle_endtag(self, tag):
+        self._flush_text()
         
-        # Шукаємо елемент з датою
-        date_element = soup.find(string=lambda text: text and today_uk in text)
+        if tag in ('script', 'style'):
+            self._raw = max(0, self._raw - 1)
+            return
+        if tag not in self._stack:
+            return
         
-        if not date_element:
-            logger.warning(f"❌ Дату {today_uk} не знайдено на сторінці")
-            # Використовуємо першу таблицю
-            all_tables = soup.find_all('table')
-            if not all_tables:
-                return None
-            target_table = all_tables[0]
-            logger.info("📋 Використовуємо першу таблицю")
-        else:
-            logger.info(f"✅ Знайдено елемент з датою!")
-            logger.info(f"📍 Текст елемента: {str(date_element)[:150]}")
+        # Закриваємо також усі незакриті вкладені елементи таблиці
+        while self._stack:
+            closed = self._stack.pop()
+            if closed == 'table':
+                self._tables.pop()
+            elif closed == 'tr':
+                self._rows.pop()
+            else:
+                self._cells.pop()
+            if closed == tag:
+                break
+    
+    def close(self):
+        super().close()
+        self._flush_text()
+
+
+def parse_events_stream(html):
+    parser = TableStreamParser()
+    parser.feed(html)
+    parser.close()
+    
+    return [
+        event if isinstance(event, str)
+        else [["".join(cell) for cell in row] for row in event]
+        for event in parser.events
+    ]
+
+
+def _lxml_cell_text(cell):
+    parts = []
+    for element in cell.iter():
+        if element is not cell and element.tail:
+            parts.append(element.tail.strip())
+        if isinstance(element.tag, str) and element.tag not in ('script', 'style') and element.text:
+            parts.append(element.text.strip())
+    return "".join(parts)
+
+
+def parse_events_lxml(html):
+    """lxml: дерево будується в C, з нього беремо лише тексти та таблиці"""
+    if not html.strip():
+        return []
+    
+    root = lxml.html.document_fromstring(html)
+    events = []
+    
+    for action, element in lxml.etree.iterwalk(root, events=('start', 'end', 'comment')):
+        if action == 'end':
+            if element.tail:
+                events.append(element.tail)
+            continue
+        
+        if action == 'comment':
+            events.append(element.text or "")
+            continue
+        
+        if element.tag == 'table':
+            events.append([
+                [_lxml_cell_text(cell) for cell in row.iter('td', 'th')]
+                for row in element.iter('tr')
+            ])
+        if element.text:
+            events.append(element.text)
+    
+    return events
+
+
+def parse_events_selectolax(html):
+    """selectolax (lexbor): найшвидший C-парсер, якщо встановлений"""
+    tree = LexborHTMLParser(html)
+    events = []
+    
+    for node in tree.root.traverse(include_text=True):
+        if node.tag == '-text':
+            events.append(node.text_content)
+        elif node.tag == '_comment':
+            events.append(node.comment_content or "")
+        elif node.tag == 'table':
+            events.append([
+                [cell.text(deep=True, separator='', strip=True) for cell in row.css('td, th')]
+                for row in node.css('tr')
+            ])
+    
+    return events
+
+
+PARSER_BACKENDS = {
+    "bs4": parse_events_bs4,
+    "stream": parse_events_stream,
+}
+if lxml is not None:
+    PARSER_BACKENDS["lxml"] = parse_events_lxml
+if LexborHTMLParser is not None:
+    PARSER_BACKENDS["selectolax"] = parse_events_selectolax
+
+if PARSER_BACKEND not in PARSER_BACKENDS:
+    logger.warning(f"⚠️ Парсер '{PARSER_BACKEND}' недоступний, використовуємо 'stream'")
+    PARSER_BACKEND = "stream"
+
+for _source in list(SOURCES.values()):
+    if _source.parser is not None and _source.parser not in PARSER_BACKENDS:
+        logger.warning(f"⚠️ Парсер '{_source.parser}' джерела {_source.id} недоступний, використовуємо '{PARSER_BACKEND}'")
+        SOURCES[_source.id] = _source._replace(parser=None)
+
+
+# Детальне трасування розбору: вимкнене за замовчуванням
+ParseTrace = namedtuple("ParseTrace", ["groups", "sample"])
+
+
+def make_parse_trace(spec, sample=1.0):
+    """"all" - всі групи, "off" або "" - вимкнено, інакше список груп через кому"""
+    spec = (spec or "").strip()
+    if not spec or spec == "off":
+        return None
+    if spec == "all":
+        return ParseTrace(None, sample)
+    return ParseTrace(frozenset(canonical_group(group) for group in spec.split(",") if group.strip()), sample)
+
+
+parse_trace = make_parse_trace(os.getenv("PARSE_TRACE", ""), float(os.getenv("PARSE_TRACE_SAMPLE", "1.0")))
+
+
+def _trace_row(trace, group):
+    if trace.groups is not None and group not in trace.groups:
+        return False
+    return trace.sample >= 1 or random.random() < trace.sample
+
+
+DATE_RE = re.compile(
+    r"(?<!\d)(\d{1,2})\s+(" + "|".join(MONTHS_UK.values()) + r")\s+(\d{4})"
+)
+MONTH_NUMBERS = {name: number for number, name in MONTHS_UK.items()}
+
+
+def find_dates(text):
+    """Дати у форматі "15 січня 2026" з тексту"""
+    dates = []
+    for day_num, month, year in DATE_RE.findall(text):
+        try:
+            dates.append(date(int(year), MONTH_NUMBERS[month], int(day_num)))
+        except ValueError:
+            continue
+    return dates
+
+
+def _parse_table(table, trace=None):
+    """Рядки таблиці замін -> група -> список замін"""
+    tracing = trace is not None and trace_logger.isEnabledFor(logging.INFO)
+    groups = {}
+    
+    for row_idx, cells in enumerate(table):
+        if len(cells) < 4:
+            continue
+        
+        group_text = cells[0]
+        group = canonical_group(group_text)
+        pair_num = cells[1]
+        traced = tracing and _trace_row(trace, group)
+        
+        # Пропускаємо заголовки
+        if not group_text or "Групи" in group_text or group_text == "№":
+            if traced:
+                trace_logger.info("Рядок %d: заголовок %r", row_idx, group_text,
+                                  extra={"event": "skip", "row": row_idx})
+            continue
+        
+        old_subject = cells[2]
+        new_subject = cells[3]
+        
+        if pair_num and pair_num not in ["№", "пар"]:
+            if "———" in old_subject:
+                old_subject = "—"
             
-            # Шукаємо таблицю після цього елемента
-            target_table = date_element.find_next('table')
+            groups.setdefault(group, []).append({
+                'group': group,
+                'pair': pair_num,
+                'old': old_subject if old_subject else "—",
+                'new': new_subject if new_subject else "—"
+            })
+            if traced:
+                trace_logger.info("Рядок %d: %s, пара %s", row_idx, group, pair_num,
+                                  extra={"event": "match", "row": row_idx, "group": group})
+        elif traced:
+            trace_logger.info("Рядок %d: %s, некоректна пара %r", row_idx, group, pair_num,
+                              extra={"event": "skip", "row": row_idx, "group": group})
+    
+    return groups
+
+
+def build_replacements_index(html, day, backend=None, trace=None):
+    """Розбір сторінки за один прохід в індекс: дата -> група -> список замін"""
+    started = perf_counter()
+    events = PARSER_BACKENDS[backend or PARSER_BACKEND](html)
+    
+    # Кожній даті відповідає перша таблиця після першої згадки цієї дати
+    tables = {}
+    waiting = []
+    first_table = None
+    
+    for event in events:
+        if isinstance(event, str):
+            for found in find_dates(event):
+                if found not in tables and found not in waiting:
+                    waiting.append(found)
+                    if trace is not None:
+                        trace_logger.info("📍 Дата %s: %.150s", found, event, extra={"event": "date"})
+        else:
+            if first_table is None:
+                first_table = event
+            for found in waiting:
+                tables[found] = event
+            waiting = []
+    
+    if not tables and first_table is not None:
+        # Сторінка без заголовків з датами - вважаємо першу таблицю сьогоднішньою
+        logger.warning("❌ Дат на сторінці не знайдено, використовуємо першу таблицю")
+        tables[day] = first_table
+    
+    if not tables:
+        logger.error("❌ Таблиць замін на сторінці не знайдено")
+        return {}
+    
+    index = {}
+    rows = matches = 0
+    parsed = {}
+    
+    for found, table in tables.items():
+        # Одна таблиця може належати кільком датам - розбираємо її один раз
+        if id(table) not in parsed:
+            parsed[id(table)] = _parse_table(table, trace)
+            rows += len(table)
+            matches += sum(len(items) for items in parsed[id(table)].values())
+        index[found.isoformat()] = parsed[id(table)]
+    
+    duration = (perf_counter() - started) * 1000
+    logger.info(
+        "📊 Розбір: %d дат, %d рядків, %d замін, %.1f мс",
+        len(index), rows, matches, duration,
+        extra={"dates": len(index), "rows": rows, "matches": matches, "duration_ms": duration}
+    )
+    
+    return index
+
+
+class ParsePool:
+    """Розбір сторінки поза циклом подій: пул процесів або потоків з тайм-аутом"""
+    
+    def __init__(self, kind, workers, timeout, max_jobs):
+        self.kind = kind
+        self.workers = workers
+        self.timeout = timeout
+        self.max_jobs = max_jobs
+        self._executor = None
+        self._semaphore = None
+    
+    def _get_executor(self):
+        if self._executor is None and self.kind == "process":
+            try:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            except (OSError, NotImplementedError) as e:
+                logger.warning(f"⚠️ Пул процесів недоступний ({e}), використовуємо потоки")
+                self.kind = "thread"
+        
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="parse")
+        
+        return self._executor
+    
+    def _reset(self):
+        """Зупиняє завислий або зламаний пул процесів; наступний виклик створить новий
+        
+        Обриваються всі задачі цього пулу, тому кожне джерело має власний пул
+        і завислий розбір одного сайту не зупиняє розбір інших.
+        """
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+        
+        if self.kind == "process":
+            # ProcessPoolExecutor не вміє переривати задачі, а публічного доступу до процесів
+            # не має, тож зупиняємо їх примусово через приватний _processes
+            for process in list(getattr(executor, "_processes", {}).values()):
+                process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    async def run(self, func, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+        
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._get_executor(), func, *args)
+            started = perf_counter()
             
-            if not target_table:
-                logger.error("❌ Таблиця після дати не знайдена")
-                return None
+            try:
+                result = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                logger.error(f"⏱️ Розбір сторінки перевищив {self.timeout} с")
+                ERRORS.inc(where="parse")
+                if self.kind == "process":
+                    self._reset()
+                raise
+            except BrokenProcessPool:
+                ERRORS.inc(where="parse")
+                self._reset()
+                raise
             
-            logger.info("✅ Знайдено таблицю ПІСЛЯ дати!")
+            PARSE_SECONDS.observe(perf_counter() - started, executor=self.kind)
+            return result
+    
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Останній розібраний індекс: (версія сторінки, дата) -> індекс
+class IndexSnapshot:
+    """Останній вдалий індекс на диску; віддається як застарілий, поки сайт недоступний"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.index = None
+        self.saved_at = None
+        self.stale = False
+        self._loaded = False
+    
+    @property
+    def stale_since(self):
+        """Час знімка, якщо зараз віддаються застарілі дані, інакше None"""
+        return self.saved_at if self.stale else None
+    
+    def save(self, index):
+        self.index = index
+        self.saved_at = datetime.now(TIMEZONE)
+        self.stale = False
+        
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"saved_at": self.saved_at.isoformat(), "index": index}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"⚠️ Не вдалося зберегти знімок замін: {e}")
+    
+    def _load(self):
+        self._loaded = True
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.index = data["index"]
+            self.saved_at = datetime.fromisoformat(data["saved_at"])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Знімок замін пошкоджено: {e}")
+    
+    def mark_fresh(self):
+        self.stale = False
+    
+    def fallback(self):
+        """Знімок для відповіді замість недоступного сайту (None, якщо знімка немає)"""
+        if self.index is None and not self._loaded:
+            self._load()
+        if self.index is None:
+            return None
         
-        # Парсимо таблицю
-        replacements = []
-        rows = target_table.find_all('tr')
-        logger.info(f"\n📊 Рядків у таблиці: {len(rows)}")
-        logger.info(f"🎯 Шукаємо групу: '{target_group}'")
-        logger.info("\n=== ВСІ ГРУПИ В ТАБЛИЦІ ===")
+        if not self.stale:
+            self.stale = True
+            logger.warning(f"📦 Сайт недоступний, віддаємо знімок від {self.saved_at:%d.%m.%Y %H:%M}")
+        return self.index
+
+
+def snapshot_path(source_id):
+    """Файл знімка джерела: основне - SNAPSHOT_PATH, інші - поруч з id у назві"""
+    if source_id == DEFAULT_SOURCE:
+        return SNAPSHOT_PATH
+    root, ext = os.path.splitext(SNAPSHOT_PATH)
+    return f"{root}-{source_id}{ext}"
+
+class PageArchive:
+    """Архів версій сторінки: стиснуті копії за хешем вмісту та розібраний індекс кожної версії"""
+    
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+    
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.join(self.path, "pages"), exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.path, "archive.db"), timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    hash TEXT PRIMARY KEY,
+                    first_seen REAL NOT NULL,
+                    last_seen REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    file TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS replacements (
+                    hash TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    grp TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (hash, day, grp)
+                );
+                CREATE INDEX IF NOT EXISTS idx_replacements_group ON replacements (grp, day);
+            """)
+        return self._conn
+    
+    @staticmethod
+    def _compress(data):
+        if zstandard is not None:
+            return ".zst", zstandard.ZstdCompressor(level=10).compress(data)
+        return ".gz", gzip.compress(data, 6)
+    
+    @staticmethod
+    def _decompress(file, data):
+        if file.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError("Для читання .zst потрібен пакет zstandard")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+    
+    def store(self, html, index, source=None):
+        """Зберігає версію сторінки один раз; для відомої версії лише оновлює час"""
+        data = html.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        now = unix_time()
+        conn = self._connection()
         
-        for row_idx, row in enumerate(rows):
-            cells = row.find_all(['td', 'th'])
+        with conn:
+            updated = conn.execute(
+                "UPDATE pages SET last_seen = ? WHERE hash = ?", (now, digest)
+            ).rowcount
+            if updated:
+                return digest
             
-            if len(cells) >= 4:
-                group_text = cells[0].get_text(strip=True)
-                pair_num = cells[1].get_text(strip=True)
-                
-                # Логуємо всі рядки
-                logger.info(f"Рядок {row_idx}: '{group_text}' | Пара: '{pair_num}'")
-                
-                # Пропускаємо заголовки
-                if not group_text or "Групи" in group_text or group_text == "№":
-                    logger.info(f"  ⏭️ Пропускаємо (заголовок)")
-                    continue
-                
-                # перевіряємо групу
-                if target_group == group_text:
-                    logger.info(f"  ✅✅✅ ТОЧНЕ СПІВПАДІННЯ!")
-                    
-                    old_subject = cells[2].get_text(strip=True)
-                    new_subject = cells[3].get_text(strip=True)
-                    
-                    if pair_num and pair_num not in ["№", "пар"]:
-                        if "———" in old_subject:
-                            old_subject = "—"
-                        
-                        replacements.append({
-                            'group': group_text,
-                            'pair': pair_num,
-                            'old': old_subject if old_subject else "—",
-                            'new': new_subject if new_subject else "—"
-                        })
-                        logger.info(f"  ✅ ДОДАНО заміну: пара {pair_num}")
-                    else:
-                        logger.info(f"  ⏭️ Пропускаємо (некоректна пара: '{pair_num}')")
-                else:
-                    logger.info(f"  ❌ Не співпадає (шукали '{target_group}', знайшли '{group_text}')")
-        
-        logger.info(f"\n{'='*50}")
-        logger.info(f"🎯 ПІДСУМОК: {len(replacements)} замін для '{target_group}'")
-        
-        if len(replacements) == 0:
-            logger.warning(f"⚠️ Жодної заміни не знайдено для групи '{target_group}'")
-            logger.warning(f"⚠️ Можливо група записана інакше на сайті?")
-        
-        return replacements if replacements else None
+            suffix, blob = self._compress(data)
+            file = os.path.join("pages", digest[:2], digest + ".html" + suffix)
+            full_path = os.path.join(self.path, file)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "wb") as f:
+                f.write(blob)
+            
+            conn.execute(
+                "INSERT INTO pages (hash, first_seen, last_seen, size, file) VALUES (?, ?, ?, ?, ?)",
+                (digest, now, now, len(data), file)
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO replacements (hash, day, grp, payload) VALUES (?, ?, ?, ?)",
+                [
+                    (digest, day, qualify_group(source or DEFAULT_SOURCE, group), json.dumps(items, ensure_ascii=False))
+                    for day, groups in index.items()
+                    for group, items in groups.items()
+                ]
+            )
         
+        logger.info(f"🗄 Нова версія сторінки в архіві: {digest[:12]} ({len(data) / 1024:.0f} КБ → {len(blob) / 1024:.0f} КБ)")
+        return digest
+    
+    def versions(self, since=None, limit=100):
+        """Версії сторінки від найновішої: (хеш, перша поява, остання поява, розмір)"""
+        return self._connection().execute(
+            "SELECT hash, first_seen, last_seen, size FROM pages WHERE first_seen >= ? "
+            "ORDER BY first_seen DESC LIMIT ?",
+            (since or 0, limit)
+        ).fetchall()
+    
+    def read_page(self, digest):
+        row = self._connection().execute("SELECT file FROM pages WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        with open(os.path.join(self.path, row[0]), "rb") as f:
+            return self._decompress(row[0], f.read()).decode("utf-8")
+    
+    def read_index(self, digest):
+        """Індекс версії; групи неосновних джерел - з префіксом джерела"""
+        index = {}
+        rows = self._connection().execute(
+            "SELECT day, grp, payload FROM replacements WHERE hash = ?", (digest,)
+        )
+        for day, group, payload in rows:
+            index.setdefault(day, {})[group] = json.loads(payload)
+        return index
+    
+    def group_history(self, group, since=None, limit=10):
+        """Зміни замін групи від найновіших: (перша поява версії, дата, заміни); повтори пропускаються"""
+        rows = self._connection().execute(
+            "SELECT p.first_seen, r.day, r.payload FROM replacements r JOIN pages p ON p.hash = r.hash "
+            "WHERE r.grp = ? AND p.first_seen >= ? ORDER BY r.day, p.first_seen",
+            (group, since or 0)
+        )
+        
+        history = []
+        last = {}
+        for seen, day, payload in rows:
+            if last.get(day) == payload:
+                continue
+            last[day] = payload
+            history.append((datetime.fromtimestamp(seen, TIMEZONE), date.fromisoformat(day), json.loads(payload)))
+        
+        history.sort(key=itemgetter(0), reverse=True)
+        return history[:limit]
+    
+    def iter_pages(self):
+        """(хеш, перша поява, html) для всіх версій - корпус для офлайн-бенчмарків"""
+        for digest, first_seen, _, _ in reversed(self.versions(limit=-1)):
+            yield digest, datetime.fromtimestamp(first_seen, TIMEZONE), self.read_page(digest)
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+archive = PageArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+
+
+class SourceState:
+    """Усе, що належить одному джерелу: кеш сторінки, розібраний індекс, знімок і трекер змін"""
+    
+    def __init__(self, source):
+        self.source = source
+        self.page_cache = PageCache(source.url, PAGE_CACHE_TTL, source.id)
+        self.snapshot = IndexSnapshot(snapshot_path(source.id))
+        self.changes = ChangeTracker()
+        # Останній розібраний індекс: (версія сторінки, дата) -> індекс
+        self.parsed = {"key": None, "index": None}
+        self.inflight = {}
+        # Ключ індексу, який цей процес опублікував як лідер, і час останнього підтвердження
+        self._published_key = None
+        self._confirmed_at = None
+        self._fetching_alone = False
+        # Власний пул: тайм-аут розбору цього джерела перезапускає лише його процеси
+        jobs = max(1, min(source.concurrency, PARSE_MAX_JOBS))
+        self.parse_pool = ParsePool(PARSE_EXECUTOR, min(PARSE_WORKERS, jobs), PARSE_TIMEOUT, jobs)
+    
+    @property
+    def parser(self):
+        return self.source.parser or PARSER_BACKEND
+    
+    async def _parse(self, html, day, trace=None):
+        return await self.parse_pool.run(build_replacements_index, html, day, self.parser, trace)
+    
+    async def _refresh(self, html, key):
+        """Розбір нової версії та її збереження; завершується, навіть якщо викликач перестав чекати"""
+        index = await self._parse(html, key[1], parse_trace)
+        if self.parsed["key"] != key:
+            group_registry.update(index, self.source.id)
+            self.snapshot.save(index)
+            if archive is not None:
+                try:
+                    archive.store(html, index, self.source.id)
+                except Exception as e:
+                    ERRORS.inc(where="archive")
+                    logger.warning(f"⚠️ Не вдалося зберегти сторінку в архів: {e}")
+        self.parsed["index"] = index
+        self.parsed["key"] = key
+        self._share()
+        return index
+    
+    async def index(self, trace=None, refresh=False):
+        # Кілька воркерів: сторінку завантажує і розбирає лише власник оренди
+        if WORKERS > 1 and trace is None and not shared_state.is_fetcher(self.source.id):
+            # Поки оренда чужа, опубліковані рядки може переписати інший лідер
+            self._published_key = None
+            today = datetime.now(TIMEZONE).date()
+            index = shared_state.load(today, PUBLISHED_MAX_AGE, self.source.id)
+            if index is not None:
+                self._fetching_alone = False
+                group_registry.update(index, self.source.id)
+                return index
+            # Лідер давно не перевіряв сторінку або індекс за інший день: завантажуємо самі, без публікації
+            if not self._fetching_alone:
+                self._fetching_alone = True
+                logger.info(f"📭 Опублікований індекс {self.source.id} застарів, воркер {WORKER_INDEX} завантажує сам")
+        
+        html = await self.page_cache.get(refresh)
+        if html is None:
+            return self.snapshot.fallback()
+        self.snapshot.mark_fresh()
+        
+        today = datetime.now(TIMEZONE).date()
+        key = (self.page_cache.version, today)
+        
+        # Трасування на один запит: окремий розбір, кеш не змінюється
+        if trace is not None:
+            return await self._parse(html, today, trace)
+        
+        if self.parsed["key"] == key:
+            self._share()
+            return self.parsed["index"]
+        
+        # Одночасні виклики чекають на той самий розбір
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(html, key))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        
+        return await asyncio.shield(task)
+    
+    def _share(self):
+        """Лідер публікує свій індекс або продовжує актуальність уже опублікованого
+
+        Новий лідер міг розібрати сторінку ще як послідовник, без публікації: тоді в базі
+        лежить індекс попереднього лідера, і його не можна підтверджувати як свіжий.
+        """
+        if WORKERS == 1 or not shared_state.is_fetcher(self.source.id):
+            return
+        
+        key = self.parsed["key"]
+        if self._published_key != key:
+            shared_state.publish(self.parsed["index"], key[1], self.source.id)
+            self._published_key = key
+        elif self.page_cache.fetched_at != self._confirmed_at:
+            shared_state.confirm(self.source.id)
+        else:
+            return
+        self._confirmed_at = self.page_cache.fetched_at
+
+
+async def get_replacements_index(trace=None, refresh=False, source=None, wait=None):
+    """Індекс замін джерела для поточної версії сторінки (розбирається один раз на версію)
+
+    wait обмежує очікування: повільне джерело віддає знімок, а завантаження триває у фоні.
+    """
+    state = source_states[source or DEFAULT_SOURCE]
+    if wait is None:
+        return await _load_index(state, trace, refresh)
+    
+    task = asyncio.ensure_future(_load_index(state, trace, refresh))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), wait)
+    except asyncio.TimeoutError:
+        ERRORS.inc(where="source_timeout")
+        logger.warning(f"🐢 Джерело {state.source.id} не відповіло за {wait:g} с")
+        return state.snapshot.fallback()
+
+
+async def _load_index(state, trace=None, refresh=False):
+    try:
+        return await state.index(trace, refresh)
+    except CircuitOpenError:
+        return state.snapshot.fallback()
     except Exception as e:
-        logger.error(f"💥 ПОМИЛКА: {e}")
+        ERRORS.inc(where="index")
+        logger.error(f"💥 ПОМИЛКА ({state.source.id}): {e!r}")
         import traceback
         logger.error(traceback.format_exc())
+        return state.snapshot.fallback()
+
+
+def lookup_replacements(index, target_group, day=None):
+    """Заміни для групи з готового індексу"""
+    if not index:
         return None
+    
+    day = day or datetime.now(TIMEZONE).date()
+    replacements = index.get(day.isoformat(), {}).get(canonical_group(target_group))
+    
+    return replacements if replacements else None
 
 
-def format_message(replacements, group_name):
-    """Форматування повідомлення про заміни"""
-    if not replacements:
-        return [f"📋 Змін для групи {group_name} не знайдено"]
+async def parse_replacements(target_group, trace=None, day=None):
+    """Парсинг таблиці замін з сайту для конкретної групи (ключа підписки)"""
+    source_id, target_group = split_group(target_group)
+    index = await get_replacements_index(trace, source=source_id)
+    replacements = lookup_replacements(index, target_group, day)
+    
+    if index is not None and not replacements:
+        logger.warning(f"⚠️ Жодної заміни не знайдено для групи '{target_group}'")
+    
+    return replacements
+
+
+def content_hash(replacements):
+    """Стабільний хеш вмісту замін групи"""
+    payload = json.dumps(replacements, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """LRU-кеш готових повідомлень: (група, дата, хеш вмісту) -> частини повідомлення"""
+    
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
     
-    today = datetime.now(TIMEZONE).strftime("%d.%m.%Y")
+    def get(self, key, render):
+        messages = self._items.get(key)
+        
+        if messages is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return messages
+        
+        self.misses += 1
+        started = perf_counter()
+        messages = self._items[key] = tuple(render())
+        RENDER_SECONDS.observe(perf_counter() - started)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        
+        return messages
+
+
+render_cache = RenderCache(RENDER_CACHE_SIZE)
+
+
+# Відповідь, коли сайт недоступний і збереженого знімка немає
+UNAVAILABLE_MESSAGE = (
+    "⚠️ Сайт коледжу зараз недоступний, тому заміни не вдалося отримати. Спробуйте пізніше.",
+)
+
+
+def format_message(replacements, group_name, day=None, stale_since=None):
+    """Форматування повідомлення про заміни (однакові заміни рендеряться один раз)"""
+    day = day or datetime.now(TIMEZONE).date()
+    key = (group_name, day, content_hash(replacements) if replacements else None, stale_since)
+    
+    return render_cache.get(key, lambda: _render_message(replacements, group_name, day, stale_since))
+
+
+def _render_message(replacements, group_name, day, stale_since=None):
+    # Дані зі знімка: сайт недоступний, тож попереджаємо, що вони можуть бути неактуальні
+    stale_note = ""
+    if stale_since is not None:
+        stale_note = (
+            f"⚠️ Сайт коледжу недоступний, показано дані станом на "
+            f"{stale_since.strftime('%d.%m.%Y %H:%M')}\n\n"
+        )
+    
+    if not replacements:
+        return [f"{stale_note}📋 Змін для групи {group_name} на {day.strftime('%d.%m.%Y')} не знайдено"]
     
     messages = []
-    current_message = f"📢 <b>Заміни для групи {group_name}</b>\n"
-    current_message += f"📅 Дата: {today}\n\n"
+    current_message = f"{stale_note}📢 <b>Заміни для групи {group_name}</b>\n"
+    current_message += f"📅 Дата: {day.strftime('%d.%m.%Y')}\n\n"
     
     for idx, repl in enumerate(replacements, 1):
         repl_text = f"<b>{idx}. Пара №{repl['pair']}</b>\n"
@@ -182,27 +2187,348 @@ def format_message(replacements, group_name):
         else:
             current_message += repl_text
     
-    if current_message.strip():
-        messages.append(current_message.strip())
+    if current_message.strip():
+        messages.append(current_message.strip())
+    
+    return messages
+
+
+class ChangeTracker:
+    """Відстежує зміни замін кожної групи за хешем рядків, окремо для кожної відстежуваної дати"""
+    
+    def __init__(self):
+        # дата -> (група -> хеш, група -> пара -> заміна)
+        self._days = {}
+    
+    def update(self, snapshots):
+        """Порівнює знімки {дата: {група: заміни}} з попередніми; повертає {дата: {група: (додані, змінені, скасовані)}}
+
+        Дати, яких немає в snapshots, забуваються. Вчорашнє «завтра» стає сьогоднішнім
+        днем без втрати попереднього знімка.
+        """
+        self._days = {day: state for day, state in self._days.items() if day in snapshots}
+        changes = {}
+        
+        for day, groups in snapshots.items():
+            if day not in self._days:
+                # Перший знімок дати лише запам'ятовується - повні заміни прийдуть у щоденній розсилці
+                self._days[day] = (
+                    {group: content_hash(items) for group, items in groups.items()},
+                    {group: _pairs_map(items) for group, items in groups.items()}
+                )
+                continue
+            
+            day_changes = self._diff(groups, *self._days[day])
+            if day_changes:
+                changes[day] = day_changes
+        
+        return changes
+    
+    @staticmethod
+    def _diff(groups, hashes, pairs):
+        changes = {}
+        for group in set(groups) | set(hashes):
+            items = groups.get(group, [])
+            digest = content_hash(items) if items else None
+            
+            if digest == hashes.get(group):
+                continue
+            
+            old_pairs = pairs.get(group, {})
+            new_pairs = _pairs_map(items)
+            
+            added = [new_pairs[pair] for pair in new_pairs if pair not in old_pairs]
+            changed = [new_pairs[pair] for pair in new_pairs if pair in old_pairs and new_pairs[pair] != old_pairs[pair]]
+            removed = [old_pairs[pair] for pair in old_pairs if pair not in new_pairs]
+            
+            if digest is None:
+                hashes.pop(group, None)
+                pairs.pop(group, None)
+            else:
+                hashes[group] = digest
+                pairs[group] = new_pairs
+            
+            if added or changed or removed:
+                changes[group] = (added, changed, removed)
+        
+        return changes
+
+
+def _pairs_map(items):
+    """Пара -> заміна; повтори однієї пари об'єднуються"""
+    pairs = {}
+    for repl in items:
+        if repl['pair'] in pairs:
+            previous = pairs[repl['pair']]
+            repl = dict(repl, old=f"{previous['old']}; {repl['old']}", new=f"{previous['new']}; {repl['new']}")
+        pairs[repl['pair']] = repl
+    return pairs
+
+
+# Стан кожного джерела; порядок - як у налаштуваннях
+source_states = {source_id: SourceState(source) for source_id, source in SOURCES.items()}
+
+
+def format_changes(group_name, changes, day):
+    """Повідомлення лише про зміни замін з моменту попередньої перевірки"""
+    added, changed, removed = changes
+    
+    lines = []
+    for repl in added:
+        lines.append(
+            f"🆕 <b>Пара №{repl['pair']}</b>\n"
+            f"❌ Було: {repl['old'][:200]}\n"
+            f"✅ Буде: {repl['new'][:200]}\n\n"
+        )
+    for repl in changed:
+        lines.append(
+            f"✏️ <b>Пара №{repl['pair']} (змінено)</b>\n"
+            f"❌ Було: {repl['old'][:200]}\n"
+            f"✅ Буде: {repl['new'][:200]}\n\n"
+        )
+    for repl in removed:
+        lines.append(f"🗑 <b>Пара №{repl['pair']}</b>: заміну скасовано\n\n")
+    
+    messages = []
+    current_message = f"🔔 <b>Оновлення замін для групи {group_name}</b>\n"
+    current_message += f"📅 Дата: {day.strftime('%d.%m.%Y')}\n\n"
+    
+    for text in lines:
+        if len(current_message) + len(text) > 4000:
+            messages.append(current_message.strip())
+            current_message = text
+        else:
+            current_message += text
+    
+    if current_message.strip():
+        messages.append(current_message.strip())
+    
+    return messages
+
+
+class TokenBucket:
+    """Token bucket: rate токенів за секунду, не більше capacity одночасно"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+    
+    def _refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+    
+    def pause(self, seconds):
+        """Забирає токени так, щоб наступний з'явився не раніше ніж через seconds"""
+        self._refill()
+        self.tokens = min(self.tokens, -seconds * self.rate)
+    
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Пріоритети черги відправки: менше значення - раніше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class DeliveryEngine:
+    """Черга відправки повідомлень з пріоритетами, пулом воркерів і лімітами Telegram"""
+    
+    def __init__(self, workers, global_rate, chat_rate):
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._queue = None
+        self._order = count()
+        self._tasks = []
+        self.pending = Counter()
+        self.sent = 0
+        self.retry_after = 0
+    
+    def start(self):
+        if self._tasks:
+            return
+        
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"📤 Запущено {self.workers} воркерів відправки")
+    
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+    
+    def submit(self, bot, chat_id, messages, priority=PRIORITY_BULK, **kwargs):
+        """Ставить у чергу повідомлення для одного чату; повертає future з результатом"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        # Порядковий номер зберігає FIFO в межах одного пріоритету
+        self._queue.put_nowait((priority, next(self._order), (bot, chat_id, messages, kwargs, future)))
+        self.pending[priority] += 1
+        return future
+    
+    async def send(self, bot, chat_id, messages, priority=PRIORITY_BULK, **kwargs):
+        await self.submit(bot, chat_id, messages, priority, **kwargs)
+    
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        
+        if bucket is None:
+            # Прибираємо відро чатів, які вже давно нічого не отримували
+            if len(self._chat_buckets) >= 10000:
+                self._chat_buckets = {
+                    key: value for key, value in self._chat_buckets.items() if not value.is_full()
+                }
+            bucket = TokenBucket(self.chat_rate, CHAT_BURST)
+            self._chat_buckets[chat_id] = bucket
+        
+        return bucket
+    
+    async def _worker(self):
+        while True:
+            priority, _, (bot, chat_id, messages, kwargs, future) = await self._queue.get()
+            self.pending[priority] -= 1
+            try:
+                for text in messages:
+                    await self._send_one(bot, chat_id, text, kwargs)
+                if not future.done():
+                    future.set_result(True)
+            except Exception as e:
+                ERRORS.inc(where="send")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self._queue.task_done()
+    
+    async def _send_one(self, bot, chat_id, text, kwargs):
+        chat_bucket = self._chat_bucket(chat_id)
+        
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            
+            started = perf_counter()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                SEND_SECONDS.observe(perf_counter() - started)
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                RETRY_AFTER.inc()
+                if attempt == SEND_MAX_RETRIES:
+                    raise
+                
+                self.retry_after += 1
+                delay = float(e.retry_after)
+                logger.warning(f"⏳ RetryAfter {delay} с для чату {chat_id}")
+                # Telegram обмежує бота цілком, тому пригальмовуємо всіх воркерів
+                self.global_bucket.pause(delay)
+
+
+# Глобальний ліміт Telegram діє на бота загалом, тому ділиться між процесами
+delivery = DeliveryEngine(SEND_WORKERS, GLOBAL_RATE_LIMIT / WORKERS, CHAT_RATE_LIMIT)
+
+
+class CheckScheduler:
+    """Допуск запитів /check: пауза для користувача, обмежена кількість і об'єднання однакових запитів"""
+    
+    def __init__(self, cooldown, max_pending):
+        self.cooldown = cooldown
+        self.max_pending = max_pending
+        self.pending = 0
+        self._last = {}
+        self._inflight = {}
+    
+    def cooldown_left(self, user_id):
+        """Скільки секунд користувачу ще чекати (0 - запит дозволено)"""
+        last = self._last.get(user_id)
+        if last is not None and monotonic() - last < self.cooldown:
+            return self.cooldown - (monotonic() - last)
+        return 0
+    
+    def admit(self, user_id):
+        """Займає місце в черзі (False - черга заповнена); пауза користувача починається лише з прийнятого запиту"""
+        if self.pending >= self.max_pending:
+            return False
+        self.pending += 1
+        
+        now = monotonic()
+        if len(self._last) >= 10000:
+            self._last = {key: value for key, value in self._last.items() if now - value < self.cooldown}
+        self._last[user_id] = now
+        return True
     
-    return messages
+    def release(self):
+        self.pending -= 1
+    
+    async def run(self, key, compute):
+        """Однакові одночасні запити чекають на одне обчислення; повертає (результат, чи об'єднано)"""
+        task = self._inflight.get(key)
+        coalesced = task is not None
+        
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        
+        return await asyncio.shield(task), coalesced
+
+
+check_scheduler = CheckScheduler(CHECK_COOLDOWN, CHECK_MAX_PENDING)
+
+
+def get_group_selection_keyboard(source=None):
+    """Створює клавіатуру з вибором груп; з кількома джерелами спершу обирається джерело"""
+    if source is None and len(SOURCES) > 1:
+        return get_source_selection_keyboard()
+    source = source or DEFAULT_SOURCE
+    return _group_selection_keyboard(source, group_registry.groups(source))
+
+
+@lru_cache(maxsize=None)
+def get_source_selection_keyboard():
+    """Клавіатура вибору джерела (закладу чи відділення)"""
+    keyboard = [
+        [InlineKeyboardButton(source.name, callback_data=f"source_{source.id}")]
+        for source in SOURCES.values()
+    ]
+    return InlineKeyboardMarkup(keyboard)
 
 
-def get_group_selection_keyboard():
-    """Створює клавіатуру з вибором груп"""
+@lru_cache(maxsize=32)
+def _group_selection_keyboard(source, groups):
     keyboard = []
     row = []
     
-    for idx, group in enumerate(GROUPS):
-        row.append(InlineKeyboardButton(group, callback_data=f"select_{group}"))
+    for idx, group in enumerate(groups):
+        row.append(InlineKeyboardButton(group, callback_data=f"select_{qualify_group(source, group)}"))
         
-        if len(row) == 2 or idx == len(GROUPS) - 1:
+        if len(row) == 2 or idx == len(groups) - 1:
             keyboard.append(row)
             row = []
     
+    if len(SOURCES) > 1:
+        keyboard.append([InlineKeyboardButton("◀️ Інше джерело", callback_data="change_group")])
+    
     return InlineKeyboardMarkup(keyboard)
 
 
+# Статичні клавіатури будуються один раз
+@lru_cache(maxsize=None)
 def get_main_menu_keyboard():
     """Головне меню після підписки"""
     keyboard = [
@@ -213,6 +2539,7 @@ def get_main_menu_keyboard():
     return InlineKeyboardMarkup(keyboard)
 
 
+@lru_cache(maxsize=None)
 def get_settings_keyboard():
     """Меню налаштувань"""
     keyboard = [
@@ -224,6 +2551,7 @@ def get_settings_keyboard():
     return InlineKeyboardMarkup(keyboard)
 
 
+@lru_cache(maxsize=None)
 def get_time_selection_keyboard():
     """Клавіатура вибору часу сповіщень"""
     keyboard = [
@@ -241,9 +2569,11 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     update_groups_for_new_year()
     
-    if user_id in user_data:
-        group = user_data[user_id].get("group", "не обрана")
-        notify_time = user_data[user_id].get("time", DEFAULT_NOTIFICATION_TIME)
+    record = subscribers.get(user_id)
+    
+    if record is not None:
+        group = display_group(record.group) or "не обрана"
+        notify_time = notification_time(record.minute)
         
         await update.message.reply_text(
             f"👋 <b>З поверненням!</b>\n\n"
@@ -257,7 +2587,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "👋 <b>Вітаю!</b>\n\n"
             "Я бот для відстеження замін у МБК.\n"
-            "Оберіть вашу групу:",
+            + ("Оберіть вашу групу:" if len(SOURCES) == 1 else "Оберіть навчальний заклад і групу:"),
             parse_mode='HTML',
             reply_markup=get_group_selection_keyboard()
         )
@@ -277,24 +2607,29 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=get_group_selection_keyboard()
         )
     
-    elif query.data.startswith("select_"):
-        selected_group = query.data.replace("select_", "")
-        
-        if user_id not in user_data:
-            user_data[user_id] = {}
+    elif query.data.startswith("source_"):
+        source_id = query.data.replace("source_", "", 1)
+        if source_id not in SOURCES:
+            return
         
-        user_data[user_id]["group"] = selected_group
+        await query.edit_message_text(
+            f"🏫 <b>{SOURCES[source_id].name}</b>: оберіть групу",
+            parse_mode='HTML',
+            reply_markup=get_group_selection_keyboard(source_id)
+        )
+    
+    elif query.data.startswith("select_"):
+        selected_group = canonical_subscription(query.data.replace("select_", "", 1))
         
-        if "time" not in user_data[user_id]:
-            user_data[user_id]["time"] = DEFAULT_NOTIFICATION_TIME
+        record = subscribers.set_group(user_id, selected_group)
         
         logger.info(f"Користувач {user_id} підписався на групу {selected_group}")
         
-        notify_time = user_data[user_id]["time"]
+        notify_time = notification_time(record.minute)
         
         await query.edit_message_text(
             f"✅ <b>Підписка оформлена!</b>\n\n"
-            f"📚 Група: <b>{selected_group}</b>\n"
+            f"📚 Група: <b>{display_group(selected_group)}</b>\n"
             f"🕐 Час сповіщень: <b>{notify_time.strftime('%H:%M')}</b>\n\n"
             f"📬 Повідомлення надходитимуть щодня.\n"
             f"🔍 Перевірити зараз: /check",
@@ -318,18 +2653,15 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "Час вказується за київським часовим поясом.",
                 parse_mode='HTML'
             )
-            context.user_data['waiting_custom_time'] = True
+            subscribers.set_state(user_id, STATE_WAITING_CUSTOM_TIME)
         else:
             time_str = query.data.replace("time_", "")
             hour, minute = map(int, time_str.split(":"))
             new_time = time(hour, minute, 0)
             
-            if user_id not in user_data:
-                user_data[user_id] = {}
-            
-            user_data[user_id]["time"] = new_time
+            record = subscribers.set_time(user_id, new_time)
             
-            group = user_data[user_id].get("group", "не обрана")
+            group = display_group(record.group) or "не обрана"
             
             await query.edit_message_text(
                 f"✅ <b>Час оновлено!</b>\n\n"
@@ -341,8 +2673,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
     
     elif query.data == "settings":
-        group = user_data.get(user_id, {}).get("group", "не обрана")
-        notify_time = user_data.get(user_id, {}).get("time", DEFAULT_NOTIFICATION_TIME)
+        record = subscribers.get(user_id)
+        group = display_group(record.group) if record and record.group else "не обрана"
+        notify_time = notification_time(record.minute if record else DEFAULT_NOTIFICATION_MINUTE)
         
         await query.edit_message_text(
             f"⚙️ <b>Налаштування</b>\n\n"
@@ -353,8 +2686,9 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
     
     elif query.data == "back_to_menu":
-        group = user_data.get(user_id, {}).get("group", "не обрана")
-        notify_time = user_data.get(user_id, {}).get("time", DEFAULT_NOTIFICATION_TIME)
+        record = subscribers.get(user_id)
+        group = display_group(record.group) if record and record.group else "не обрана"
+        notify_time = notification_time(record.minute if record else DEFAULT_NOTIFICATION_MINUTE)
         
         await query.edit_message_text(
             f"📚 Ваша група: <b>{group}</b>\n"
@@ -372,15 +2706,15 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Ваше повідомлення буде надіслано адміністратору.",
             parse_mode='HTML'
         )
-        context.user_data['waiting_report'] = True
+        subscribers.set_state(user_id, STATE_WAITING_REPORT)
 
 
 async def handle_custom_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка введення користувацького часу"""
-    if not context.user_data.get('waiting_custom_time'):
+    user_id = update.effective_user.id
+    if not subscribers.has_state(user_id, STATE_WAITING_CUSTOM_TIME):
         return
     
-    user_id = update.effective_user.id
     text = update.message.text.strip()
     
     try:
@@ -391,13 +2725,10 @@ async def handle_custom_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         new_time = time(hour, minute, 0)
         
-        if user_id not in user_data:
-            user_data[user_id] = {}
+        record = subscribers.set_time(user_id, new_time)
+        subscribers.set_state(user_id, STATE_WAITING_CUSTOM_TIME, False)
         
-        user_data[user_id]["time"] = new_time
-        context.user_data['waiting_custom_time'] = False
-        
-        group = user_data[user_id].get("group", "не обрана")
+        group = display_group(record.group) or "не обрана"
         
         await update.message.reply_text(
             f"✅ <b>Час оновлено!</b>\n\n"
@@ -418,15 +2749,16 @@ async def handle_custom_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробка повідомлення про помилку"""
-    if not context.user_data.get('waiting_report'):
+    user_id = update.effective_user.id
+    if not subscribers.has_state(user_id, STATE_WAITING_REPORT):
         # Якщо не в режимі очікування репорту, перевіряємо custom time
-        if context.user_data.get('waiting_custom_time'):
+        if subscribers.has_state(user_id, STATE_WAITING_CUSTOM_TIME):
             await handle_custom_time(update, context)
         return
     
-    user_id = update.effective_user.id
     report_text = update.message.text
-    group = user_data.get(user_id, {}).get("group", "не вказана")
+    record = subscribers.get(user_id)
+    group = display_group(record.group) if record and record.group else "не вказана"
     now = datetime.now(TIMEZONE).strftime("%d.%m.%Y %H:%M")
     
     admin_message = (
@@ -444,7 +2776,7 @@ async def handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='HTML'
         )
         
-        context.user_data['waiting_report'] = False
+        subscribers.set_state(user_id, STATE_WAITING_REPORT, False)
         
         await update.message.reply_text(
             "✅ <b>Дякуємо!</b>\n\n"
@@ -456,6 +2788,7 @@ async def handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         logger.info(f"Отримано звіт від користувача {user_id}, надіслано до {ADMIN_ID}")
     except Exception as e:
+        ERRORS.inc(where="report")
         logger.error(f"Помилка відправки звіту до {ADMIN_ID}: {e}")
         await update.message.reply_text(
             f"❌ Виникла помилка при відправці повідомлення: {e}\n"
@@ -464,11 +2797,37 @@ async def handle_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+def parse_check_date(text, today):
+    """Дата з аргументу /check: сьогодні, завтра, післязавтра, ДД.ММ або ДД.ММ.РРРР"""
+    text = text.strip().lower()
+    
+    if text in ("", "сьогодні"):
+        return today
+    if text == "завтра":
+        return today + timedelta(days=1)
+    if text == "післязавтра":
+        return today + timedelta(days=2)
+    
+    try:
+        if text.count(".") == 1:
+            parsed = datetime.strptime(f"{text}.{today.year}", "%d.%m.%Y").date()
+            # 02.01 у грудні - це вже наступний рік
+            if parsed < today - timedelta(days=180):
+                parsed = parsed.replace(year=today.year + 1)
+            return parsed
+        return datetime.strptime(text, "%d.%m.%Y").date()
+    except ValueError:
+        found = find_dates(text)
+        return found[0] if found else None
+
+
 async def check(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробник команди /check"""
     user_id = update.effective_user.id
     
-    if user_id not in user_data or "group" not in user_data[user_id]:
+    record = subscribers.get(user_id)
+    
+    if record is None or not record.group:
         await update.message.reply_text(
             "❌ Ви не підписані на жодну групу.\n"
             "Використайте /start щоб обрати групу.",
@@ -476,35 +2835,86 @@ async def check(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    user_group = user_data[user_id]["group"]
-    await update.message.reply_text(f"🔍 Перевіряю заміни для групи {user_group}...")
+    args = list(context.args or [])
+    
+    # /check trace - детальне трасування розбору для цього запиту (лише адміністратор)
+    source_id, group = split_group(record.group)
+    trace = None
+    if user_id == ADMIN_ID and "trace" in args:
+        args.remove("trace")
+        trace = ParseTrace(frozenset([group]), 1.0)
+    
+    # /check завтра, /check 15.01, /check 15.01.2026
+    day = parse_check_date(" ".join(args), datetime.now(TIMEZONE).date())
+    if day is None:
+        await update.message.reply_text(
+            "❌ Невірна дата!\n\n"
+            "Приклади: <code>/check</code>, <code>/check завтра</code>, "
+            "<code>/check 15.01</code>",
+            parse_mode='HTML'
+        )
+        return
+    
+    # Повторні запити одного користувача відхиляються до кінця паузи
+    wait = check_scheduler.cooldown_left(user_id) if user_id != ADMIN_ID else 0
+    if wait:
+        CHECK_REQUESTS.inc(result="cooldown")
+        await update.message.reply_text(f"⏳ Ви щойно перевіряли заміни. Спробуйте через {wait:.0f} с.")
+        return
+    
+    # Перевантаження: краще одразу відмовити, ніж змушувати всіх чекати дедалі довше
+    if not check_scheduler.admit(user_id):
+        CHECK_REQUESTS.inc(result="shed")
+        await update.message.reply_text("🚦 Зараз забагато запитів. Спробуйте за хвилину.")
+        return
+    
+    user_group = display_group(record.group)
     
     try:
-        replacements = await parse_replacements(user_group)
-        messages = format_message(replacements, user_group)
+        await update.message.reply_text(
+            f"🔍 Перевіряю заміни для групи {user_group} на {day.strftime('%d.%m.%Y')}..."
+        )
+        
+        async def compute():
+            index = await get_replacements_index(trace, source=source_id, wait=SOURCE_WAIT)
+            if index is None:
+                return UNAVAILABLE_MESSAGE
+            replacements = lookup_replacements(index, group, day)
+            return format_message(replacements, user_group, day, source_states[source_id].snapshot.stale_since)
+        
+        if trace is not None:
+            messages, coalesced = await compute(), False
+        else:
+            messages, coalesced = await check_scheduler.run((record.group, day), compute)
+        CHECK_REQUESTS.inc(result="coalesced" if coalesced else "ok")
         
-        for msg in messages:
-            await update.message.reply_text(msg, parse_mode='HTML')
-            await asyncio.sleep(0.5)
+        await delivery.send(
+            context.bot, update.effective_chat.id, messages, PRIORITY_INTERACTIVE, parse_mode='HTML'
+        )
     except Exception as e:
+        ERRORS.inc(where="check")
         logger.error(f"Помилка при перевірці замін: {e}")
         await update.message.reply_text(
             "❌ Виникла помилка при перевірці замін. Спробуйте пізніше."
         )
+    finally:
+        check_scheduler.release()
 
 
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обробник команди /settings"""
     user_id = update.effective_user.id
     
-    if user_id not in user_data:
+    record = subscribers.get(user_id)
+    
+    if record is None:
         await update.message.reply_text(
             "❌ Спочатку оберіть групу через /start"
         )
         return
     
-    group = user_data[user_id].get("group", "не обрана")
-    notify_time = user_data[user_id].get("time", DEFAULT_NOTIFICATION_TIME)
+    group = display_group(record.group) or "не обрана"
+    notify_time = notification_time(record.minute)
     
     await update.message.reply_text(
         f"⚙️ <b>Налаштування</b>\n\n"
@@ -515,44 +2925,466 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробник команди /trace (адміністратор): /trace all|off|група,група [частка]"""
+    global parse_trace
+    
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    args = context.args or []
+    try:
+        sample = float(args[1]) if len(args) > 1 else 1.0
+    except ValueError:
+        sample = 1.0
+    
+    parse_trace = make_parse_trace(args[0] if args else "off", sample)
+    # Наступний розбір піде вже з новими налаштуваннями
+    for state in source_states.values():
+        state.parsed["key"] = None
+    
+    if parse_trace is None:
+        text = "🔇 Трасування розбору вимкнено"
+    else:
+        groups = "всі групи" if parse_trace.groups is None else ", ".join(sorted(parse_trace.groups))
+        text = f"🔊 Трасування розбору: {groups}, вибірка {parse_trace.sample:g}"
+    
+    await update.message.reply_text(text)
+
+
+def _format_histogram(title, histogram):
+    count, average, p95 = histogram.summary()
+    if not count:
+        return f"{title}: немає даних"
+    p95_text = f"≤ {p95:g} с" if p95 is not None else f"> {histogram.buckets[-1]:g} с"
+    return f"{title}: {count}, середнє {average:.3f} с, p95 {p95_text}"
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробник команди /stats (адміністратор): зведення метрик процесу"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    errors = ", ".join(f"{key[0]}: {value}" for key, value in sorted(ERRORS.values().items())) or "немає"
+    groups = subscribers.count_by_group()
+    minutes = subscribers.count_by_minute()
+    busiest = ", ".join(
+        f"{notification_time(minute).strftime('%H:%M')} ({count})"
+        for minute, count in minutes.most_common(3)
+    ) or "немає"
+    
+    lines = [
+        "📊 <b>Статистика</b>",
+        "",
+        _format_histogram("🌐 Завантаження сторінки", FETCH_SECONDS),
+        _format_histogram("🧩 Розбір", PARSE_SECONDS),
+        _format_histogram("🖋 Рендеринг", RENDER_SECONDS),
+        _format_histogram("📤 Відправка", SEND_SECONDS),
+        _format_histogram("📣 Розсилка", BROADCAST_SECONDS),
+        f"⏱ Лаг останньої розсилки: {BROADCAST_LAST_LAG.total():.1f} с",
+        "",
+    ]
+    for source_id, state in source_states.items():
+        cache = state.page_cache.stats()
+        prefix = "Сайт: " if len(SOURCES) == 1 else f"{state.source.name}: "
+        lines.append(
+            f"🔌 {prefix}{'запити призупинено' if state.page_cache.breaker.is_open() else 'доступний'}"
+            + (f", віддається знімок від {state.snapshot.saved_at:%d.%m %H:%M}" if state.snapshot.stale else "")
+            + f"; кеш: {cache['hits']} влучань, {cache['misses']} промахів, {cache['not_modified']} × 304"
+        )
+    lines += [
+        "",
+        f"🗂 Кеш повідомлень: {render_cache.hits} влучань, {render_cache.misses} промахів",
+        f"✉️ Надіслано: {delivery.sent}, RetryAfter: {RETRY_AFTER.total():g}",
+        "🔍 /check: " + ", ".join(
+            f"{key[0]}: {value:g}" for key, value in sorted(CHECK_REQUESTS.values().items())
+        ) + f"; в обробці {check_scheduler.pending}",
+        f"❗️ Помилки: {errors}",
+        "",
+        f"👥 Підписники: {sum(groups.values())}",
+    ]
+    lines.extend(f"  • {display_group(group)}: {count}" for group, count in sorted(groups.items()))
+    lines.append(f"🕗 Найпопулярніший час: {busiest}")
+    
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+
+async def history_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробник команди /history (адміністратор): /history група [днів]"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    args = list(context.args or [])
+    days = int(args.pop()) if len(args) > 1 and args[-1].isdigit() else 7
+    group = canonical_subscription(" ".join(args))
+    
+    if not group:
+        await update.message.reply_text(
+            "Використання: /history [джерело:]група [днів], напр. /history КН-107 7"
+        )
+        return
+    if archive is None:
+        await update.message.reply_text("🗄 Архів сторінок вимкнено (ARCHIVE_DIR)")
+        return
+    
+    since = unix_time() - days * 86400
+    history = archive.group_history(group, since)
+    if not history:
+        await update.message.reply_text(f"🗄 За {days} дн. в архіві немає замін для групи {group}")
+        return
+    
+    text = f"🗄 <b>Історія замін для групи {group}</b> ({days} дн.)\n"
+    for seen, day, items in history:
+        block = f"\n🕓 {seen.strftime('%d.%m %H:%M')} → на {day.strftime('%d.%m.%Y')}, замін: {len(items)}\n"
+        block += "".join(f"  №{item['pair']}: {item['old'][:40]} → {item['new'][:40]}\n" for item in items)
+        if len(text) + len(block) > 4000:
+            break
+        text += block
+    
+    await update.message.reply_text(text, parse_mode='HTML')
+
+
+async def outbox_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробник команди /outbox (адміністратор): стан черги; /outbox retry - повторити невдалі"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    args = context.args or []
+    if args and args[0] == "retry":
+        count = outbox.retry_failed()
+        await update.message.reply_text(f"🔁 Повторно поставлено в чергу: {count}")
+        return
+    
+    counts = outbox.counts()
+    lines = [
+        "📬 <b>Черга розсилки</b>",
+        "",
+        f"⏳ Очікують: {counts.get('pending', 0)}",
+        f"✅ Доставлено: {counts.get('sent', 0)}",
+        f"❌ Не доставлено: {counts.get('failed', 0)}",
+        f"⌛️ Застаріло: {counts.get('expired', 0)}",
+    ]
+    
+    oldest = outbox.oldest_pending()
+    if oldest is not None:
+        lines.append(f"🕓 Найстаріший запис: {(unix_time() - oldest) / 60:.0f} хв тому")
+    
+    for status, title in (("pending", "Очікують"), ("failed", "Не доставлено")):
+        rows = outbox.backlog(status)
+        if not rows:
+            continue
+        lines.extend(["", f"<b>{title}:</b>"])
+        for user_id, key, part, attempts, next_attempt, error in rows:
+            line = f"  • {user_id} {key}#{part}, спроб: {attempts}"
+            if status == "pending" and next_attempt > unix_time():
+                line += f", повтор через {next_attempt - unix_time():.0f} с"
+            if error:
+                line += f" ({error[:60].replace('<', '&lt;')})"
+            lines.append(line)
+    
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обробник команди /profile (адміністратор): /profile [sample 0.1 | threshold 0.5 | memory on|off | off]"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    
+    args = context.args or []
+    try:
+        if args and args[0] == "off":
+            profiler.sample = 0.0
+            profiler.set_memory(False)
+        elif len(args) == 2 and args[0] == "sample":
+            profiler.sample = min(1.0, max(0.0, float(args[1])))
+        elif len(args) == 2 and args[0] == "threshold":
+            profiler.threshold = max(0.0, float(args[1]))
+        elif len(args) == 2 and args[0] == "memory":
+            profiler.set_memory(args[1] == "on")
+        elif args:
+            raise ValueError(args[0])
+    except ValueError:
+        await update.message.reply_text(
+            "Використання: /profile [sample 0.1 | threshold 0.5 | memory on|off | off]"
+        )
+        return
+    
+    lines = [
+        "🩺 <b>Профілювання</b>",
+        "",
+        f"Вибірка: {profiler.sample:g}, поріг: {profiler.threshold:g} с, "
+        f"пам'ять: {'так' if profiler.memory else 'ні'}",
+        f"Збережено профілів: {profiler.dumps} ({profiler.directory})",
+        "",
+    ]
+    for name in sorted(profiler.slowest):
+        calls, wall, _ = HANDLER_SECONDS.summary(handler=name)
+        _, cpu, _ = HANDLER_CPU_SECONDS.summary(handler=name)
+        lines.append(
+            f"• {name}: {calls}, середнє {wall * 1000:.1f} мс (CPU {cpu * 1000:.1f} мс), "
+            f"макс {profiler.slowest[name] * 1000:.0f} мс"
+        )
+    
+    await update.message.reply_text("\n".join(lines), parse_mode='HTML')
+
+
 async def send_daily_notification(context: ContextTypes.DEFAULT_TYPE):
     """Щоденна розсилка сповіщень"""
+    await broadcast_due(context.bot)
+
+
+BROADCAST_CATCHUP = 60  # хвилин, пропущені тіки доганяються в межах доби
+
+_last_broadcast = None  # (дата, хвилина) останнього обробленого тіку
+_broadcast_since = None  # початок найстарішої хвилини, чиї сповіщення ще відправляються
+
+
+async def broadcast_due(bot):
+    """Ставить у чергу сповіщення своєї частини (шарду) за цю хвилину; відправка йде у фоні"""
+    global _last_broadcast
+    now = datetime.now(TIMEZONE)
+    current = minute_of_day(now.time())
+    
+    # Планувальник пропускає запуск, поки попередній ще працює: такі хвилини доганяються зараз
+    first = current
+    if _last_broadcast is not None and _last_broadcast[0] == now.date():
+        first = max(_last_broadcast[1] + 1, current - BROADCAST_CATCHUP)
+    
+    # Хвилина вважається обробленою лише після постановки в чергу: після помилки її повторить наступний тік
+    for minute in range(first, current + 1):
+        await broadcast_minute(bot, now, minute)
+        _last_broadcast = (now.date(), minute)
+
+
+async def broadcast_minute(bot, now, minute):
+    global _broadcast_since
+    
+    # Хвилини без підписників нічого не коштують
+    if not subscribers.has_due(minute):
+        return
+    
+    # Вечірні сповіщення надсилають заміни на завтра з того самого індексу
+    day = now.date()
+    if minute >= EVENING_NOTIFICATION_HOUR * 60:
+        day += timedelta(days=1)
+    
     logger.info("Запуск щоденної розсилки")
     update_groups_for_new_year()
     
+    started = monotonic()
+    # Кожне джерело ставить свою частину в чергу, щойно готовий його індекс: повільне не затримує інших
+    results = await asyncio.gather(
+        *(broadcast_source(bot, source_id, minute, day) for source_id in SOURCES),
+        return_exceptions=True
+    )
+    
+    queued = 0
+    for source_id, result in zip(SOURCES, results):
+        if isinstance(result, Exception):
+            ERRORS.inc(where="broadcast")
+            logger.error(f"Помилка при розсилці ({source_id}): {result}")
+            continue
+        queued += result
+    
+    if queued:
+        # Лаг рахується від початку хвилини, коли підписники чекають на сповіщення
+        if _broadcast_since is None:
+            _broadcast_since = now.replace(hour=minute // 60, minute=minute % 60, second=0, microsecond=0)
+        start_drain(bot)
+    
+    logger.info(f"Сповіщення: у черзі {queued} за {monotonic() - started:.1f} с")
+    cache_stats = {source_id: state.page_cache.stats() for source_id, state in source_states.items()}
+    logger.info(f"Кеш сторінки: {cache_stats}")
+
+
+async def broadcast_source(bot, source_id, minute, day):
+    """Частина розсилки одного джерела; повертає кількість нових записів у черзі"""
+    if not subscribers.has_due(minute, source_id):
+        return 0
+    
+    # Сторінка розбирається один раз на розсилку, далі лише пошук в індексі
+    state = source_states[source_id]
+    index = await get_replacements_index(source=source_id, wait=SOURCE_WAIT)
+    
+    def entries():
+        due = subscribers.iter_due(minute, WORKER_INDEX, WORKERS, source_id)
+        for user_group, rows in groupby(due, key=itemgetter(0)):
+            if index is None:
+                messages = UNAVAILABLE_MESSAGE
+            else:
+                replacements = lookup_replacements(index, split_group(user_group)[1], day)
+                messages = format_message(replacements, display_group(user_group), day, state.snapshot.stale_since)
+            
+            for _, user_id in rows:
+                yield user_id, messages
+    
+    # Спершу вся розсилка записується в чергу, тож після перезапуску вона продовжиться.
+    # Вечірня розсилка на завтра і ранкова того ж дня - різні повідомлення
+    kind = "evening" if minute >= EVENING_NOTIFICATION_HOUR * 60 else "morning"
+    queued = outbox.enqueue(f"daily:{day.isoformat()}:{kind}", entries())
+    # Відправка не тримає тік: наступна хвилина запуститься вчасно
+    start_drain(bot)
+    return queued
+
+
+outbox_lock = asyncio.Lock()
+
+
+async def _deliver_outbox_row(bot, row):
+    user_id, key, part, text, attempts = row
     try:
-        current_time = datetime.now(TIMEZONE).time()
-        current_hour_minute = time(current_time.hour, current_time.minute)
+        await delivery.submit(bot, user_id, (text,), parse_mode='HTML')
+    except (Forbidden, BadRequest) as e:
+        # Користувач заблокував бота або повідомлення некоректне: повтор не допоможе
+        outbox.mark_failed(user_id, key, part, attempts, str(e), permanent=True)
+        logger.warning(f"Повідомлення {key} для {user_id} відхилено: {e}")
+        return False
+    except Exception as e:
+        if not outbox.mark_failed(user_id, key, part, attempts, str(e)):
+            logger.error(f"Повідомлення {key} для {user_id} не доставлено після {attempts + 1} спроб: {e}")
+        return False
+    
+    outbox.mark_sent(user_id, key, part)
+    return True
+
+
+async def drain_outbox(bot):
+    """Відправляє готові частини з черги, доки вони є; повертає (надіслано, невдало)"""
+    sent = failed = 0
+    
+    async with outbox_lock:
+        # Після простою вчорашні сповіщення вже не надсилаються
+        expired = outbox.expire(datetime.now(TIMEZONE).date())
+        if expired:
+            logger.warning(f"⌛️ У черзі застаріло {expired} недоставлених записів за минулі дні")
         
-        for user_id, data in user_data.items():
-            user_time = data.get("time", DEFAULT_NOTIFICATION_TIME)
-            user_group = data.get("group")
+        while True:
+            rows = outbox.due_batch(OUTBOX_BATCH, WORKER_INDEX, WORKERS)
+            if not rows:
+                break
             
-            if not user_group:
-                continue
-            
-            if user_time.hour == current_hour_minute.hour and user_time.minute == current_hour_minute.minute:
-                logger.info(f"Відправка сповіщення користувачу {user_id} (група {user_group})")
-                
-                try:
-                    replacements = await parse_replacements(user_group)
-                    messages = format_message(replacements, user_group)
-                    
-                    for msg in messages:
-                        await context.bot.send_message(
-                            chat_id=user_id,
-                            text=msg,
-                            parse_mode='HTML'
-                        )
-                        await asyncio.sleep(0.3)
-                    
-                    logger.info(f"Сповіщення відправлено користувачу {user_id}")
-                except Exception as e:
-                    logger.error(f"Помилка відправки користувачу {user_id}: {e}")
-                
-                await asyncio.sleep(1)
+            results = await asyncio.gather(*(_deliver_outbox_row(bot, row) for row in rows))
+            delivered = sum(results)
+            sent += delivered
+            failed += len(results) - delivered
+    
+    return sent, failed
+
+
+drain_task = None
+
+
+def start_drain(bot):
+    """Запускає відправку черги у фоні, якщо вона ще не йде; прохід сам підбирає нові записи"""
+    global drain_task
+    if drain_task is None or drain_task.done():
+        drain_task = asyncio.ensure_future(_drain_in_background(bot))
+    return drain_task
+
+
+async def _drain_in_background(bot):
+    global _broadcast_since
+    started = monotonic()
+    try:
+        sent, failed = await drain_outbox(bot)
+    except Exception as e:
+        ERRORS.inc(where="outbox")
+        logger.error(f"Помилка обробки черги: {e}")
+        return
+    
+    if sent or failed:
+        logger.info(f"📬 Черга: надіслано {sent}, помилок {failed} за {monotonic() - started:.1f} с")
+    
+    # Черга спорожніла: розсилки, що чекали, доставлено
+    if _broadcast_since is not None:
+        BROADCAST_SECONDS.observe(monotonic() - started)
+        lag = (datetime.now(TIMEZONE) - _broadcast_since).total_seconds()
+        BROADCAST_LAG_SECONDS.observe(lag)
+        BROADCAST_LAST_LAG.set(lag)
+        _broadcast_since = None
+
+
+async def stop_drain():
+    """Перериває відправку при зупинці; недоставлені записи залишаються в черзі"""
+    if drain_task is not None and not drain_task.done():
+        drain_task.cancel()
+        try:
+            await drain_task
+        except asyncio.CancelledError:
+            pass
+
+
+async def drain_outbox_job(context: ContextTypes.DEFAULT_TYPE):
+    """Повтори та залишок черги після перезапуску"""
+    start_drain(context.bot)
+
+
+async def prune_outbox(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        removed = outbox.prune(OUTBOX_RETENTION_DAYS)
+        if removed:
+            logger.info(f"🧹 З черги видалено {removed} старих записів")
+    except Exception as e:
+        logger.error(f"Помилка очищення черги: {e}")
+
+
+async def flush_subscribers(context: ContextTypes.DEFAULT_TYPE):
+    """Періодичний запис змін підписок у базу"""
+    try:
+        subscribers.flush()
     except Exception as e:
-        logger.error(f"Помилка при розсилці: {e}")
+        logger.error(f"Помилка запису підписок: {e}")
+
+
+def change_recipients(group, for_today, minute):
+    """Підписники групи, які вже отримали список на цю дату; решта побачить повний список у свій час
+
+    Сьогоднішні зміни - ранковим підписникам після їхнього часу та вечірнім весь день
+    (їхній список на сьогодні прийшов учора ввечері). Завтрашні - вечірнім після їхнього часу.
+    """
+    evening = EVENING_NOTIFICATION_HOUR * 60
+    if not for_today:
+        return subscribers.iter_group(group, minute, evening)
+    if minute >= evening:
+        return subscribers.iter_group(group)
+    return chain(subscribers.iter_group(group, minute), subscribers.iter_group(group, 1439, evening))
+
+
+async def poll_changes(context: ContextTypes.DEFAULT_TYPE):
+    """Фонова перевірка сторінки джерела: підписникам надсилаються лише зміни їхньої групи"""
+    source_id = context.job.data if context.job and context.job.data else DEFAULT_SOURCE
+    state = source_states[source_id]
+    
+    index = await get_replacements_index(refresh=True, source=source_id)
+    # Знімок не свіжий, порівнювати його зі сторінкою немає сенсу
+    if index is None or state.snapshot.stale:
+        return
+    
+    now = datetime.now(TIMEZONE)
+    today = now.date()
+    # Вечірні підписники вже отримали список на завтра, тож завтрашні зміни теж відстежуються
+    days = (today, today + timedelta(days=1))
+    changes = state.changes.update({day: index.get(day.isoformat(), {}) for day in days})
+    
+    if not changes:
+        return
+    
+    minute = minute_of_day(now.time())
+    queued = 0
+    
+    for day, day_changes in changes.items():
+        logger.info(f"🔔 Зміни в замінах ({source_id}, {day:%d.%m}): {', '.join(sorted(day_changes))}")
+        
+        for group, group_changes in day_changes.items():
+            group = qualify_group(source_id, group)
+            messages = format_changes(display_group(group), group_changes, day)
+            key = f"changes:{day.isoformat()}:{group}:{content_hash(messages)[:12]}"
+            queued += outbox.enqueue(key, (
+                (user_id, messages) for user_id in change_recipients(group, day == today, minute)
+            ))
+    
+    start_drain(context.bot)
+    logger.info(f"🔔 Оновлення: у черзі {queued}")
 
 
 async def post_init(application: Application):
@@ -560,14 +3392,264 @@ async def post_init(application: Application):
     job_queue = application.job_queue
     
     job_queue.run_repeating(
-        send_daily_notification,
+        profiler.wrap(send_daily_notification),
         interval=60,
         first=10
     )
     
+    job_queue.run_repeating(
+        profiler.wrap(flush_subscribers),
+        interval=DB_FLUSH_INTERVAL,
+        first=DB_FLUSH_INTERVAL
+    )
+    
+    # Кожне джерело перевіряється за своїм розкладом
+    for source in SOURCES.values():
+        if source.poll_interval > 0:
+            job_queue.run_repeating(
+                profiler.wrap(poll_changes),
+                interval=source.poll_interval,
+                first=5,
+                data=source.id,
+                name=f"poll_changes:{source.id}"
+            )
+    
+    # Після перезапуску черга продовжується з місця зупинки
+    job_queue.run_repeating(
+        profiler.wrap(drain_outbox_job),
+        interval=OUTBOX_DRAIN_INTERVAL,
+        first=5
+    )
+    
+    job_queue.run_repeating(
+        profiler.wrap(prune_outbox),
+        interval=3600,
+        first=60
+    )
+    
+    subscribers.load()
+    update_groups_for_new_year()
+    get_http_session()
+    delivery.start()
+    await start_metrics_server(METRICS_PORT)
+    
     logger.info("Налаштовано щоденну розсилку (перевірка кожну хвилину)")
 
 
+async def post_shutdown(application: Application):
+    """Звільнення ресурсів при зупинці"""
+    await stop_drain()
+    await delivery.stop()
+    subscribers.close()
+    outbox.close()
+    group_registry.close()
+    if archive is not None:
+        archive.close()
+    for state in source_states.values():
+        state.parse_pool.shutdown()
+    await close_http_session()
+    await stop_metrics_server()
+
+
+async def _shard_worker_main(index, parent_pid):
+    """Цикл додаткового воркера: розсилка свого шарду кожну хвилину"""
+    # SIGTERM від основного процесу завершує цикл із звільненням ресурсів
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    get_http_session()
+    delivery.start()
+    await start_metrics_server(METRICS_PORT + index if METRICS_PORT else 0)
+    
+    try:
+        async with Bot(TOKEN) as bot:
+            logger.info(f"Воркер {index}/{WORKERS} запущено")
+            # Основний процес зник, не зупинивши воркер: виходимо разом з ним
+            while os.getppid() == parent_pid:
+                try:
+                    # Лідер оновлює і публікує індекси, решта читає їх з бази
+                    await asyncio.gather(*(
+                        get_replacements_index(source=source_id, wait=SOURCE_WAIT) for source_id in SOURCES
+                    ))
+                    await broadcast_due(bot)
+                    # Повтори та оновлення для свого шарду, поставлені іншими воркерами
+                    start_drain(bot)
+                except Exception as e:
+                    # Напр. «database is locked»: воркер живе далі, хвилину повторить наступний тік
+                    ERRORS.inc(where="shard")
+                    logger.error(f"💥 Воркер {index}: помилка циклу розсилки: {e!r}")
+                await asyncio.sleep(60 - datetime.now(TIMEZONE).second)
+    finally:
+        await stop_drain()
+        await delivery.stop()
+        subscribers.close()
+        outbox.close()
+        group_registry.close()
+        if archive is not None:
+            archive.close()
+        for state in source_states.values():
+            state.parse_pool.shutdown()
+        await close_http_session()
+        await stop_metrics_server()
+
+
+def run_shard_worker(index, parent_pid):
+    """Точка входу окремого процесу-воркера"""
+    global WORKER_INDEX
+    WORKER_INDEX = index
+    try:
+        asyncio.run(_shard_worker_main(index, parent_pid))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    logger.info(f"Воркер {index} зупинено")
+
+
+def start_shard_workers():
+    """Запускає воркери 1..WORKERS-1; воркер 0 - основний процес з обробкою оновлень"""
+    # Не daemon: воркери самі запускають процеси пулу розбору, daemon-процесам це заборонено
+    ctx = multiprocessing.get_context("spawn")
+    processes = []
+    for index in range(1, WORKERS):
+        process = ctx.Process(target=run_shard_worker, args=(index, os.getpid()), name=f"shard-{index}")
+        process.start()
+        processes.append(process)
+    return processes
+
+
+def stop_shard_workers(processes, timeout=10):
+    """Зупиняє воркери через SIGTERM; ті, що не завершились за timeout, примусово"""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            logger.warning(f"⚠️ Воркер {process.name} не зупинився за {timeout} с")
+            process.kill()
+            process.join()
+
+
+metrics_runner = None
+
+
+async def start_metrics_server(port):
+    """Віддає /metrics у форматі Prometheus на локальному порту"""
+    global metrics_runner
+    
+    if port <= 0 or metrics_runner is not None:
+        return
+    
+    async def handle_metrics(request):
+        return web.Response(
+            body=metrics.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+    
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    
+    try:
+        await web.TCPSite(runner, METRICS_HOST, port).start()
+    except OSError as e:
+        logger.warning(f"⚠️ Не вдалося відкрити порт метрик {METRICS_HOST}:{port}: {e}")
+        await runner.cleanup()
+        return
+    
+    metrics_runner = runner
+    logger.info(f"📈 Метрики: http://{METRICS_HOST}:{port}/metrics")
+
+
+async def stop_metrics_server():
+    global metrics_runner
+    
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    metrics_runner = None
+
+
+def build_webhook_app(application: Application):
+    """aiohttp-застосунок для webhook: прийом оновлень і перевірка стану"""
+    async def handle_update(request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not WEBHOOK_SECRET or not secrets.compare_digest(token, WEBHOOK_SECRET):
+            return web.Response(status=403)
+        
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+        
+        try:
+            update = Update.de_json(data, application.bot)
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+        
+        await application.update_queue.put(update)
+        return web.Response(text="ok")
+    
+    async def health(request):
+        return web.json_response({
+            "status": "ok",
+            "subscribers": len(subscribers),
+            "page_cache": {source_id: state.page_cache.stats() for source_id, state in source_states.items()},
+        })
+    
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+async def run_webhook(application: Application):
+    """Запуск у режимі webhook з вбудованим aiohttp-сервером"""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=ALLOWED_UPDATES
+        )
+        logger.info(f"🌐 Webhook встановлено: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    else:
+        logger.warning("⚠️ WEBHOOK_URL не задано - webhook у Telegram не реєструється (локальний режим)")
+    
+    runner = web.AppRunner(build_webhook_app(application), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logger.info(f"🌐 Сервер webhook слухає {WEBHOOK_HOST}:{WEBHOOK_PORT}")
+    
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await application.shutdown()
+
+
+async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """MessageHandler для текстових повідомлень (custom time і reports)"""
+    user_id = update.effective_user.id
+    if subscribers.has_state(user_id, STATE_WAITING_CUSTOM_TIME):
+        await handle_custom_time(update, context)
+    elif subscribers.has_state(user_id, STATE_WAITING_REPORT):
+        await handle_report(update, context)
+
+
 def main():
     """Головна функція запуску бота"""
     logger.info("Запуск бота...")
@@ -576,25 +3658,33 @@ def main():
         Application.builder()
         .token(TOKEN)
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
     
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("check", check))
-    application.add_handler(CommandHandler("settings", settings_command))
-    application.add_handler(CallbackQueryHandler(button_callback))
-    
-    # MessageHandler для текстових повідомлень (custom time і reports)
-    async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if context.user_data.get('waiting_custom_time'):
-            await handle_custom_time(update, context)
-        elif context.user_data.get('waiting_report'):
-            await handle_report(update, context)
+    # Усі обробники проходять через profiler: час виконання і вибіркові профілі
+    application.add_handler(CommandHandler("start", profiler.wrap(start)))
+    application.add_handler(CommandHandler("check", profiler.wrap(check)))
+    application.add_handler(CommandHandler("settings", profiler.wrap(settings_command)))
+    application.add_handler(CommandHandler("trace", profiler.wrap(trace_command)))
+    application.add_handler(CommandHandler("stats", profiler.wrap(stats_command)))
+    application.add_handler(CommandHandler("history", profiler.wrap(history_command)))
+    application.add_handler(CommandHandler("outbox", profiler.wrap(outbox_command)))
+    application.add_handler(CommandHandler("profile", profiler.wrap(profile_command)))
+    application.add_handler(CallbackQueryHandler(profiler.wrap(button_callback)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, profiler.wrap(text_handler)))
     
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
+    shard_processes = start_shard_workers() if WORKERS > 1 else []
     
     logger.info("Бот запущено успішно!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    
+    try:
+        if RUN_MODE == "webhook":
+            asyncio.run(run_webhook(application))
+        else:
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
+    finally:
+        stop_shard_workers(shard_processes)
 
 
 if __name__ == '__main__':